@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+#
+# Compare loading routers/*.yml with the pure-Python and libyaml loaders
+#
+
+import argparse
+import os
+import time
+import yaml
+
+from peerfile import LineNumbers, SafeLineLoader
+from snapshot import load_snapshot
+
+
+class PySafeLineLoader(LineNumbers, yaml.SafeLoader):
+    '''SafeLineLoader as it is without libyaml'''
+
+
+def load_all(filenames, loader):
+    peers = []
+    for filename in filenames:
+        with open(filename, 'r') as fd:
+            peers.append(yaml.load(fd, Loader=loader))
+    return peers
+
+
+def bench(filenames, loader, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        load_all(filenames, loader)
+    return (time.perf_counter() - start) / rounds
+
+
+def bench_snapshot(rounds):
+    load_snapshot()  # compiled once if stale
+    start = time.perf_counter()
+    for _ in range(rounds):
+        list(load_snapshot().peers())
+    return (time.perf_counter() - start) / rounds
+
+
+def main(args):
+    filenames = [f'routers/{yaml_file}' for yaml_file in sorted(os.listdir('routers'))]
+
+    if not yaml.__with_libyaml__:
+        print('libyaml is not available, nothing to compare')
+        return
+
+    # both loaders must produce the same peers and line numbers
+    if load_all(filenames, PySafeLineLoader) != load_all(filenames, SafeLineLoader):
+        print('Loaders disagree')
+        exit(1)
+
+    python = bench(filenames, PySafeLineLoader, args.rounds)
+    libyaml = bench(filenames, SafeLineLoader, args.rounds)
+
+    print(f'Loading {len(filenames)} router files, mean of {args.rounds} rounds')
+    print(f'  SafeLoader:  {python * 1000:8.2f} ms')
+    print(f'  CSafeLoader: {libyaml * 1000:8.2f} ms')
+    print(f'  Speedup:     {python / libyaml:8.1f}x')
+    print(f'  Snapshot:    {bench_snapshot(args.rounds) * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark router file loading')
+    parser.add_argument('--rounds', type=int, default=20, help='Number of times to load every file')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,64 @@
+#
+# Find router peers changed relative to a git ref
+#
+
+import os
+import subprocess
+
+from fnmatch import fnmatch
+from functools import lru_cache
+from peerfile import safe_load, strip_lines
+
+# Changes to any of these can change the result for every peer
+VALIDATION_FILES = ('*.py', 'requirements.txt')
+
+
+def _git(*args):
+    return subprocess.run(['git', *args], check=True, capture_output=True, text=True).stdout
+
+
+@lru_cache
+def merge_base(ref):
+    return _git('merge-base', ref, 'HEAD').strip()
+
+
+def changed_routers(ref):
+    '''
+    Router files (e.g. router.lon1.yml) added or modified since ref,
+    including uncommitted changes, or None when a change to the
+    validation itself means every router must be checked
+    '''
+    files = _git('diff', '--name-only', '--diff-filter=d', merge_base(ref)).splitlines()
+
+    if any(fnmatch(f, pattern) for f in files for pattern in VALIDATION_FILES):
+        return None
+
+    return sorted(
+        os.path.basename(f) for f in files
+        if os.path.dirname(f) == 'routers' and f.endswith('.yml')
+    )
+
+
+@lru_cache
+def base_peers(ref, filename):
+    '''Peers in filename as of ref, by name'''
+    try:
+        content = _git('show', f'{merge_base(ref)}:{filename}')
+    except subprocess.CalledProcessError:
+        # file is new
+        return {}
+
+    return {
+        peer.get('name'): peer
+        for peer in safe_load(content) or [] if isinstance(peer, dict)
+    }
+
+
+def is_changed_peer(ref, filename, peer):
+    '''Whether peer was added or modified in filename since ref'''
+    return strip_lines(peer) != base_peers(ref, filename).get(peer.get('name'))
+
+
+def changed_peers(ref, filename, peers):
+    '''Peers that were added or modified in filename since ref'''
+    return [peer for peer in peers if is_changed_peer(ref, filename, peer)]
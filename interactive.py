@@ -5,10 +5,14 @@ import cmd
 import yaml
 import validate_config as validations
 
+from concurrent.futures import ThreadPoolExecutor
 from os import listdir
 from pathlib import Path
+from peerfile import IndentDumper, PeerFile
+from nodes import NodeCatalog
 from registry import Registry
-from routedbits import RoutedBits
+from resolver import Resolver, endpoint_hostnames
+from snapshot import load_snapshot
 from validate_config import validate
 
 class output:
@@ -54,38 +58,23 @@ class output:
             output.print(f'{key}:\t{val}', status=status)
         print('\n' * lines_after)
 
-class IndentDumper(yaml.Dumper):
-    def increase_indent(self, flow=False, indentless=False):
-        return super(IndentDumper, self).increase_indent(flow, False)
-
-def load_router_peers(router):
-    with open(f'routers/{router}.yml', 'r') as fd:
-        peers = yaml.safe_load(fd)
-
-    # no peers set to empty list to avoid NoneType
-    if not peers:
-        peers = []
-
-    return peers
-
-def save_router_peers(router, peers):
-    # Sort peers by name before saving
-    peers = sorted(peers, key=lambda peer: peer['name'])
-
-    with open(f'routers/{router}.yml', 'w') as fd:
-        # YAML document header
-        fd.write('---\n')
-        # Write out each peer to router file (do not sort each peers keys)
-        for peer in peers:
-            fd.write(yaml.dump([peer], Dumper=IndentDumper, sort_keys=False))
-            # Don't write newline after last peer
-            if peer != peers[-1]:
-                fd.write('\n')
-
 def main(args):
     peer = {}
-    registry = Registry()
-    nodes = RoutedBits().nodes(minimal=True)
+    registry = validations.registry
+    registry.max_age = args.registry_max_age
+    resolver = validations.resolver
+    resolver.timeout = args.dns_timeout
+    # a session waits on its user, lookups are not limited to a run's budget
+    resolver.budget = None
+
+    # Warm the registry and DNS answers while the first questions are answered
+    background = ThreadPoolExecutor(4)
+    background.submit(registry.asn_index)
+    dns_cache = background.submit(resolver.load_cache, args.dns_cache, max_age=args.dns_max_age)
+    snapshot = background.submit(load_snapshot)
+
+    validations.catalog.max_age = args.nodes_max_age
+    nodes = validations.catalog.nodes()
 
     # Router
     router = None
@@ -100,11 +89,14 @@ def main(args):
             output.fail('ERROR: Not a valid selection, try again')
 
     node_type = next(node['type'] for node in nodes if node['hostname'] == router)
+    router_file = background.submit(PeerFile, f'routers/{router}.yml')
 
     # ASN
     while True:
         try:
             asn = int(output.ask('DN42 ASN: '))
+            if args.registry:
+                r_asn = background.submit(registry.asn, asn)
             if not (error := validations.validate_asn(asn)):
                 break
             output.fail(error)
@@ -113,12 +105,19 @@ def main(args):
 
     # Print ASN data from registry
     if args.registry:
-        r_asn = registry.asn(asn)
+        r_asn = r_asn.result()
         output.table({
             'AS-NAME': r_asn.get('as-name', ''),
             'Description': r_asn.get('descr', '')
         }, status=output.OK)
 
+    # Where the ASN already peers with us
+    for peer_router, existing in snapshot.result().asn_peers(asn):
+        if peer_router == router:
+            output.warning(f"AS{asn} already peers with {router} as {existing.get('name', '<missing>')}")
+        else:
+            output.print(f"AS{asn} peers with {peer_router} as {existing.get('name', '<missing>')}", status=output.OK)
+
     # Name
     while True:
         peer_name = output.ask('Peer Name: ')
@@ -218,6 +217,11 @@ def main(args):
         if remote_address:
             wireguard['remote_address'] = remote_address
 
+            # resolve the endpoint while the remaining questions are answered,
+            # looking it up again if it timed out the last time it was entered
+            dns_cache.result()
+            resolver.submit(endpoint_hostnames([{'wireguard': wireguard}]), retry=True)
+
         # Wireguard Listen Port
         # Port only required if remote_address specified
         if remote_address:
@@ -254,17 +258,30 @@ def main(args):
         output.print(f'# routers/{router}.yml', lines_after=1)
         output.print(yaml.dump(peers, Dumper=IndentDumper, sort_keys=False))
     else:
-        # Write YAML to selected router
-        peers = load_router_peers(router)
-        peers.append(peer)
-        save_router_peers(router, peers)
+        # Write YAML to selected router, in alphabetical order
+        router_file = router_file.result()
+        router_file.insert(peer)
+        router_file.save()
         output.ok(f'Successfully saved peer to {router}.yml')
 
+    resolver.save_cache()
+    background.shutdown(cancel_futures=True)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Generate dn42-peers configuration')
     parser.add_argument('--stdout', action=argparse.BooleanOptionalAction,
             help='Output peer configuration to stdout')
     parser.add_argument('--registry', action=argparse.BooleanOptionalAction,
             help='Output registry data during questions')
+    parser.add_argument('--registry-max-age', type=int, default=Registry.MAX_AGE,
+            help='Maximum seconds to use the registry snapshot before refreshing it')
+    parser.add_argument('--nodes-max-age', type=int, default=NodeCatalog.MAX_AGE,
+            help='Maximum seconds to use the node catalog snapshot before refreshing it')
+    parser.add_argument('--dns-cache', default='.cache/dns.json',
+            help='File to keep DNS answers in between runs')
+    parser.add_argument('--dns-max-age', type=int, default=Resolver.MAX_AGE,
+            help='Maximum seconds to reuse a cached DNS answer, regardless of TTL')
+    parser.add_argument('--dns-timeout', type=float, default=Resolver.TIMEOUT,
+            help='Seconds to wait for one DNS lookup')
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,114 @@
+#
+# Typed model of a router peer
+#
+
+import ipaddress
+
+from collections.abc import Mapping
+from peerfile import PeersDumper, iter_peers, strip_lines
+
+ADDRESSES = ['ipv4', 'ipv6', 'local_ipv4', 'local_ipv6']
+
+
+def parse_interface(value):
+    '''A tunnel address (e.g. 172.20.0.1/30) as an ipaddress interface, or None'''
+    try:
+        return ipaddress.ip_interface(value)
+    except ValueError:
+        return None
+
+
+class WireguardEndpoint(Mapping):
+    '''
+    A peer's wireguard settings, with remote_address parsed once. Reads
+    like the mapping it was built from, for checks that need the values
+    as written.
+    '''
+    __slots__ = ('data', 'remote_address', 'remote_port', 'public_key', 'ip')
+
+    def __init__(self, data):
+        self.data = data
+        self.remote_address = data.get('remote_address')
+        self.remote_port = data.get('remote_port')
+        self.public_key = data.get('public_key')
+
+        try:
+            self.ip = ipaddress.ip_address(self.remote_address)
+        except ValueError:
+            self.ip = None
+
+    @property
+    def hostname(self):
+        '''remote_address when it is a hostname to resolve, otherwise None'''
+        if self.ip is None and isinstance(self.remote_address, str):
+            return self.remote_address
+        return None
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class Peer(Mapping):
+    '''
+    A peer with its tunnel addresses and wireguard endpoint parsed once,
+    when loaded, and the file and line it starts on. Reads like the
+    mapping it was built from (without __line__ keys), so to_dict()
+    dumps back to the same YAML. Addresses that do not parse are None.
+    '''
+    __slots__ = ('data', 'filename', 'line', 'wireguard', *ADDRESSES)
+
+    def __init__(self, data, filename=None, line=None):
+        self.data = strip_lines(data)
+        self.filename = filename
+        self.line = data.get('__line__', line)
+
+        for attrib in ADDRESSES:
+            setattr(self, attrib, parse_interface(self.data[attrib]) if attrib in self.data else None)
+
+        wg = self.data.get('wireguard')
+        self.wireguard = WireguardEndpoint(wg) if isinstance(wg, dict) else None
+
+    @classmethod
+    def of(cls, peer):
+        '''peer as a Peer, if it is not one already'''
+        return peer if isinstance(peer, cls) else cls(peer)
+
+    def interface(self, attrib):
+        '''The parsed address of attrib (one of ADDRESSES), or None'''
+        return getattr(self, attrib)
+
+    def address(self, attrib):
+        '''attrib as a normalized address, or as written when it does not parse'''
+        interface = self.interface(attrib)
+        return str(interface.ip) if interface else str(self.data[attrib])
+
+    def to_dict(self):
+        return strip_lines(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f'Peer({self.data!r})'
+
+
+def load_peers(filename):
+    '''Peer of every peer in a router file, as it is parsed'''
+    for peer in iter_peers(filename):
+        yield Peer(peer, filename)
+
+
+PeersDumper.add_representer(Peer, lambda dumper, peer: dumper.represent_dict(peer.to_dict()))
+PeersDumper.add_representer(WireguardEndpoint, lambda dumper, wg: dumper.represent_dict(dict(wg.data)))
@@ -0,0 +1,73 @@
+#
+# RoutedBits node catalog, kept on disk between runs
+#
+
+import json
+import os
+import time
+
+from requests import RequestException
+from routedbits import RoutedBits
+
+
+class NodeCatalog(object):
+    '''
+    RoutedBits().nodes(minimal=True), served from a local snapshot while
+    it is younger than max_age. When the API cannot be reached the
+    snapshot is used regardless of its age.
+    '''
+    SNAPSHOT = '.cache/nodes.json'
+    MAX_AGE = 86400
+
+    def __init__(self, snapshot=SNAPSHOT, max_age=MAX_AGE):
+        self.snapshot = snapshot
+        self.max_age = max_age
+        self._nodes = None
+
+    def _fetch(self):
+        return RoutedBits().nodes(minimal=True)
+
+    def _load_snapshot(self):
+        if not self.snapshot or not os.path.exists(self.snapshot):
+            return None
+
+        with open(self.snapshot, 'r') as fd:
+            try:
+                return json.load(fd)
+            except ValueError:
+                return None
+
+    def _save_snapshot(self, snapshot):
+        if not self.snapshot:
+            return
+
+        os.makedirs(os.path.dirname(self.snapshot) or '.', exist_ok=True)
+        with open(f'{self.snapshot}.tmp', 'w') as fd:
+            json.dump(snapshot, fd)
+        os.replace(f'{self.snapshot}.tmp', self.snapshot)
+
+    def nodes(self):
+        '''List of every node, as from RoutedBits().nodes(minimal=True)'''
+        if self._nodes is not None:
+            return self._nodes
+
+        snapshot = self._load_snapshot()
+        if snapshot and time.time() - snapshot['fetched'] < self.max_age:
+            self._nodes = snapshot['nodes']
+            return self._nodes
+
+        try:
+            nodes = self._fetch()
+        except (RequestException, ValueError):
+            if snapshot:
+                self._nodes = snapshot['nodes']
+                return self._nodes
+            raise
+
+        self._save_snapshot({'fetched': time.time(), 'nodes': nodes})
+        self._nodes = nodes
+        return self._nodes
+
+    def node_types(self):
+        '''Node type (e.g. dual-stack or ipv4) by hostname'''
+        return {node['hostname']: node['type'] for node in self.nodes()}
@@ -0,0 +1,365 @@
+#
+# Indexes over router peers
+#
+
+import argparse
+import heapq
+import ipaddress
+
+from bisect import bisect_right
+from collections import defaultdict, namedtuple
+from itertools import accumulate
+from model import Peer
+from snapshot import load_snapshot
+
+
+def normalize_address(addr):
+    '''
+    Normalize a tunnel address so different spellings of the same
+    address compare equal, e.g. fe80::0225:0207 and fe80::225:207/64
+    '''
+    try:
+        return str(ipaddress.ip_interface(addr).ip)
+    except ValueError:
+        return str(addr)
+
+
+def normalize_endpoint(addr):
+    '''Normalize a wireguard.remote_address (IP address or hostname)'''
+    try:
+        return str(ipaddress.ip_address(addr))
+    except ValueError:
+        return str(addr).lower().rstrip('.')
+
+
+class RouterIndex(object):
+    '''
+    Index of one router's peers by name, tunnel address and wireguard
+    endpoint. Peers are added one at a time and only their keys are
+    kept, so conflicts are found without comparing every pair of peers
+    or holding on to the peers themselves. Peers are referred to by
+    their position in the file.
+    '''
+    KINDS = ['name', 'ipv4', 'ipv6', 'wireguard']
+
+    def __init__(self, peers=()):
+        self.names = []
+        self._keys = defaultdict(list)
+        self._conflicts = None
+
+        for peer in peers:
+            self.add(peer)
+
+    def _peer_keys(self, peer):
+        if 'name' in peer:
+            yield 'name', str(peer['name']), peer['name']
+
+        for af in ['ipv4', 'ipv6']:
+            if af in peer:
+                yield af, peer.address(af), peer[af]
+
+        wg = peer.get('wireguard')
+        if isinstance(wg, dict) and 'remote_address' in wg and 'remote_port' in wg:
+            yield 'wireguard', (normalize_endpoint(wg['remote_address']), str(wg['remote_port'])), \
+                f"{wg['remote_address']}:{wg['remote_port']}"
+
+    def add(self, peer):
+        '''Index peer, returning its position'''
+        peer = Peer.of(peer)
+        position = len(self.names)
+        self.names.append(peer.get('name', '<missing>'))
+
+        for kind, key, value in self._peer_keys(peer):
+            self._keys[(kind, key)].append((position, value))
+
+        self._conflicts = None
+        return position
+
+    def _find_conflicts(self):
+        conflicts = defaultdict(list)
+
+        for (kind, _), entries in self._keys.items():
+            for position, value in entries:
+                others = [other for other, _ in entries if other != position]
+                if not others:
+                    continue
+
+                if kind == 'name':
+                    conflicts[position].append((others[0], 0, f"name ({value}) must be unique per router"))
+                    continue
+
+                for other in others:
+                    # already reported as a duplicate name
+                    if self.names[other] == self.names[position]:
+                        continue
+
+                    if kind == 'wireguard':
+                        error = f"wireguard endpoint ({value}) must be unique per router: conflict with {self.names[other]}"
+                    else:
+                        error = f"{kind} address ({value}) must be unique per router: conflict with {self.names[other]}"
+
+                    conflicts[position].append((other, self.KINDS.index(kind), error))
+
+        # report in file order of the conflicting peers
+        return {position: [error for _, _, error in sorted(c)] for position, c in conflicts.items()}
+
+    def conflicts(self, position):
+        '''Errors for every other peer sharing a name, address or endpoint with the peer at position'''
+        if self._conflicts is None:
+            self._conflicts = self._find_conflicts()
+        return self._conflicts.get(position, [])
+
+
+class PrefixIndex(object):
+    '''
+    Sorted integer ranges of one router's tunnel networks (ipv4, ipv6,
+    local_ipv4, local_ipv6), used to find overlapping networks between
+    peers and the peers covering a given address. Like RouterIndex,
+    peers are added one at a time and referred to by position.
+    '''
+    ATTRIBS = ['ipv4', 'ipv6', 'local_ipv4', 'local_ipv6']
+
+    def __init__(self, peers=()):
+        self.names = []
+        self._ranges = {4: [], 6: []}
+        self._conflicts = None
+
+        for peer in peers:
+            self.add(peer)
+
+    def add(self, peer):
+        '''Index peer, returning its position'''
+        peer = Peer.of(peer)
+        position = len(self.names)
+        self.names.append(peer.get('name', '<missing>'))
+
+        for attrib in self.ATTRIBS:
+            if peer.interface(attrib) is None:
+                continue
+            network = peer.interface(attrib).network
+
+            self._ranges[network.version].append((
+                int(network.network_address), int(network.broadcast_address),
+                position, attrib, peer[attrib], network.is_link_local, peer.address(attrib)
+            ))
+
+        self._conflicts = None
+        return position
+
+    def _build(self):
+        # sorted by first address, with the highest last address seen so
+        # far to know when to stop searching backwards in covering()
+        self._first = {}
+        self._max_last = {}
+        self._conflicts = defaultdict(list)
+
+        for version, ranges in self._ranges.items():
+            ranges.sort(key=lambda r: r[:4])
+            self._first[version] = [r[0] for r in ranges]
+            self._max_last[version] = list(accumulate((r[1] for r in ranges), max))
+
+            # link-local networks are scoped to each peer's tunnel interface
+            # and never conflict; covering() still finds them
+            self._find_overlaps([r for r in ranges if not r[5]])
+
+    def _is_conflict(self, a, b):
+        _, _, a_position, a_attrib, _, _, a_address = a
+        _, _, b_position, b_attrib, _, _, b_address = b
+
+        # a peer's own addresses may share a network
+        if a_position == b_position:
+            return False
+        # identical tunnel addresses are reported by RouterIndex
+        if a_attrib in ('ipv4', 'ipv6') and b_attrib in ('ipv4', 'ipv6') and a_address == b_address:
+            return False
+        return True
+
+    def _find_overlaps(self, ranges):
+        # sweep in order of first address, keeping the ranges that have
+        # not ended yet; every one of those overlaps the next range. Our
+        # own local addresses may share a network, so they are kept apart
+        # and only checked against the peers' tunnel addresses.
+        active = {False: [], True: []}
+        for i, r in enumerate(ranges):
+            local = r[3].startswith('local_')
+            for ending in active.values():
+                while ending and ending[0][0] < r[0]:
+                    heapq.heappop(ending)
+
+            for _, j in active[False] + ([] if local else active[True]):
+                if self._is_conflict(r, ranges[j]):
+                    self._add_conflict(r, ranges[j])
+                    self._add_conflict(ranges[j], r)
+
+            heapq.heappush(active[local], (r[1], i))
+
+    def _add_conflict(self, r, other):
+        _, _, position, attrib, value, _, _ = r
+        _, _, other_position, other_attrib, other_value, _, _ = other
+        self._conflicts[position].append((
+            other_position, other_attrib,
+            f"{attrib} network ({value}) overlaps {other_attrib} ({other_value}) of {self.names[other_position]}"
+        ))
+
+    def conflicts(self, position):
+        '''Errors for every network of another peer overlapping one of the networks of the peer at position'''
+        if self._conflicts is None:
+            self._build()
+        return [error for _, _, error in sorted(self._conflicts.get(position, []))]
+
+    def covering(self, address):
+        '''(name, attrib, network) of every tunnel network containing address'''
+        if self._conflicts is None:
+            self._build()
+
+        address = ipaddress.ip_address(address)
+        first, max_last, ranges = self._first[address.version], self._max_last[address.version], self._ranges[address.version]
+
+        covering = []
+        i = bisect_right(first, int(address)) - 1
+        while i >= 0 and max_last[i] >= int(address):
+            if ranges[i][1] >= int(address):
+                covering.append(ranges[i])
+            i -= 1
+
+        return [(self.names[r[2]], r[3], r[4]) for r in sorted(covering, key=lambda r: r[2:4])]
+
+
+def normalize_asn(asn):
+    '''Normalize an ASN, e.g. AS4242420207 and 4242420207'''
+    asn = str(asn).strip()
+    return asn[2:] if asn.upper().startswith('AS') else asn
+
+
+def parse_endpoint(value):
+    '''Split host:port (or [host]:port for IPv6) into a normalized endpoint'''
+    host, _, port = value.rpartition(':')
+    return normalize_endpoint(host.strip('[]')), port
+
+
+class GlobalIndex(object):
+    '''
+    Index of the peers of every router by ASN, name, wireguard public
+    key, wireguard endpoint and tunnel address, for lookups and checks
+    across routers. Like RouterIndex only keys are kept, each mapping
+    to an Entry for every peer with that key.
+    '''
+    KINDS = ['asn', 'name', 'public_key', 'endpoint', 'address']
+
+    Entry = namedtuple('Entry', 'router position line name asn')
+
+    def __init__(self):
+        self._keys = defaultdict(list)
+        self._positions = defaultdict(int)
+        self._conflicts = None
+
+    def _peer_keys(self, peer):
+        if 'asn' in peer:
+            yield 'asn', normalize_asn(peer['asn'])
+        if 'name' in peer:
+            yield 'name', str(peer['name'])
+
+        wg = peer.get('wireguard')
+        if isinstance(wg, dict):
+            if isinstance(wg.get('public_key'), str):
+                yield 'public_key', wg['public_key']
+            if 'remote_address' in wg and 'remote_port' in wg:
+                yield 'endpoint', (normalize_endpoint(wg['remote_address']), str(wg['remote_port']))
+
+        for af in ['ipv4', 'ipv6']:
+            if af in peer:
+                yield 'address', peer.address(af)
+
+    def add(self, router, peer):
+        '''Index peer as the next peer of router, returning its position'''
+        peer = Peer.of(peer)
+        position = self._positions[router]
+        self._positions[router] += 1
+
+        entry = self.Entry(router, position, peer.line, peer.get('name', '<missing>'),
+                           normalize_asn(peer['asn']) if 'asn' in peer else None)
+        for kind, key in self._peer_keys(peer):
+            self._keys[(kind, key)].append(entry)
+
+        self._conflicts = None
+        return position
+
+    def lookup(self, kind, value):
+        '''Entries of every peer with value, e.g. lookup('asn', 'AS4242420207')'''
+        if kind == 'asn':
+            key = normalize_asn(value)
+        elif kind == 'endpoint':
+            key = parse_endpoint(value)
+        elif kind == 'address':
+            key = normalize_address(value)
+        else:
+            key = str(value)
+        return self._keys.get((kind, key), [])
+
+    def _find_conflicts(self):
+        conflicts = defaultdict(list)
+
+        for (kind, key), entries in self._keys.items():
+            if kind not in ('public_key', 'endpoint') or len(entries) < 2:
+                continue
+
+            for entry in entries:
+                for other in entries:
+                    # one network may use a key for several tunnels
+                    if kind == 'public_key' and other.asn != entry.asn:
+                        error = f"wireguard public_key is also used by {other.name} (AS{other.asn}) on {other.router}"
+                    # the same endpoint twice on a router is reported by RouterIndex
+                    elif kind == 'endpoint' and other.router != entry.router:
+                        error = f"wireguard endpoint ({key[0]}:{key[1]}) is also used by {other.name} on {other.router}"
+                    else:
+                        continue
+
+                    conflicts[(entry.router, entry.position)].append(
+                        (other.router, other.position, self.KINDS.index(kind), error))
+
+        # report in order of the conflicting peers' routers and positions
+        return {peer: [error for *_, error in sorted(c)] for peer, c in conflicts.items()}
+
+    def conflicts(self, router, position):
+        '''
+        Errors for peers of other routers sharing a wireguard endpoint
+        with the peer at position of router, and for peers of other ASNs
+        sharing its wireguard public key
+        '''
+        if self._conflicts is None:
+            self._conflicts = self._find_conflicts()
+        return self._conflicts.get((router, position), [])
+
+
+def main(args):
+    snapshot = load_snapshot()
+
+    if args.command == 'covers':
+        prefixes = PrefixIndex(peer for _, peer in snapshot.peers(args.router))
+
+        for name, attrib, network in prefixes.covering(args.address):
+            print(f"{name} {attrib}: {network}")
+
+    elif args.command == 'find':
+        index = GlobalIndex()
+        for router, peer in snapshot.peers():
+            index.add(router, peer)
+
+        for entry in index.lookup(args.kind, args.value):
+            print(f"routers/{entry.router}.yml:{entry.line} {entry.name} (AS{entry.asn})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query dn42-peers')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    covers = subparsers.add_parser('covers', help='Peers whose tunnel networks contain an address')
+    covers.add_argument('router', help='Router to search, e.g. router.lon1')
+    covers.add_argument('address', help='IPv4 or IPv6 address')
+
+    find = subparsers.add_parser('find', help='Peers of every router with an ASN, name, public key, endpoint or address')
+    find.add_argument('kind', choices=GlobalIndex.KINDS)
+    find.add_argument('value', help='e.g. AS4242420207, PEER-A, host:port or a tunnel address')
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,265 @@
+#
+# Reading, writing and patching router peer files
+#
+
+import os
+import yaml
+
+from bisect import bisect_right, insort
+from collections import defaultdict
+from collections.abc import Mapping
+from yaml.composer import Composer, ComposerError
+from yaml.constructor import ConstructorError, SafeConstructor
+from yaml.resolver import Resolver
+
+# Use libyaml when PyYAML was built with it, it parses several times faster
+try:
+    from yaml import CSafeLoader as BaseSafeLoader
+    from yaml.cyaml import CParser
+
+    class BaseStreamLoader(CParser, Composer, SafeConstructor, Resolver):
+        '''
+        libyaml parser with the Python composer, so nodes can be
+        composed one at a time from the event stream
+        '''
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+
+except ImportError:
+    from yaml import SafeLoader as BaseSafeLoader
+    BaseStreamLoader = BaseSafeLoader
+
+
+class IndentDumper(yaml.Dumper):
+    def increase_indent(self, flow=False, indentless=False):
+        return super(IndentDumper, self).increase_indent(flow, False)
+
+
+class PeersDumper(IndentDumper):
+    '''
+    Dumps a router's whole list of peers in one pass, with a blank line
+    between peers. libyaml's emitter cannot indent sequences inside
+    mappings like IndentDumper, so this stays on the Python emitter.
+    '''
+    def ignore_aliases(self, data):
+        # peers are written out in full, never as anchors to each other
+        return True
+
+    def expect_block_sequence_item(self, first=False):
+        if not first and len(self.indents) == 1 and not isinstance(self.event, yaml.SequenceEndEvent):
+            # end the previous peer, then a blank line
+            if self.column:
+                self.write_line_break()
+            self.write_line_break()
+        return super(PeersDumper, self).expect_block_sequence_item(first)
+
+
+class LineNumbers(object):
+    '''Adds the line each mapping starts on as __line__'''
+    def construct_mapping(self, node, deep=False):
+        mapping = super(LineNumbers, self).construct_mapping(node, deep=deep)
+        # Add 1 so line numbering starts at 1
+        mapping["__line__"] = node.start_mark.line + 1
+        return mapping
+
+
+class SafeLineLoader(LineNumbers, BaseSafeLoader):
+    pass
+
+
+class StreamLineLoader(LineNumbers, BaseStreamLoader):
+    pass
+
+
+def strip_lines(data):
+    '''Drop the __line__ keys added by the line loaders'''
+    if isinstance(data, Mapping):
+        return {key: strip_lines(value) for key, value in data.items() if key != '__line__'}
+    if isinstance(data, list):
+        return [strip_lines(value) for value in data]
+    return data
+
+
+def safe_load(stream):
+    '''yaml.safe_load(), with libyaml when available'''
+    return yaml.load(stream, Loader=BaseSafeLoader)
+
+
+def iter_peers(filename, lines=True):
+    '''
+    Yield the peers of a router file one at a time, as they are parsed,
+    instead of loading the whole list first. With lines, every mapping
+    gets __line__ like SafeLineLoader.
+
+    Raises yaml.YAMLError for the same files yaml.load() would
+    '''
+    with open(filename, 'r') as stream:
+        loader = StreamLineLoader(stream) if lines else BaseStreamLoader(stream)
+        try:
+            loader.get_event()  # StreamStart
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+
+            loader.get_event()  # DocumentStart
+            if not loader.check_event(yaml.SequenceStartEvent):
+                # an empty document has no peers, anything else is invalid
+                node = loader.compose_node(None, None)
+                if loader.construct_document(node) is not None:
+                    raise ConstructorError(None, None, "expected a list of peers", node.start_mark)
+            else:
+                loader.get_event()  # SequenceStart
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield loader.construct_document(loader.compose_node(None, None))
+                loader.get_event()  # SequenceEnd
+
+            loader.get_event()  # DocumentEnd
+            if not loader.check_event(yaml.StreamEndEvent):
+                event = loader.get_event()
+                raise ComposerError("expected a single document in the stream", None,
+                                    "but found another document", event.start_mark)
+        finally:
+            loader.dispose()
+
+
+class PeerFile(object):
+    '''
+    A router file that peers can be removed from, replaced in or
+    inserted into by rewriting only their own lines, leaving the
+    formatting and comments of every other peer as they are. Peers
+    are referred to by their position in the file, as from iter_peers().
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'r') as fd:
+            self._lines = fd.readlines()
+        if self._lines and not self._lines[-1].endswith('\n'):
+            self._lines[-1] += '\n'
+
+        # (first line, end line, name) of every peer, from the event stream
+        self._spans = self._find_spans()
+        self._names = [str(name) for _, _, name in self._spans]
+
+        self._replaced = {}
+        self._inserted = defaultdict(list)
+
+    def __len__(self):
+        return len(self._spans)
+
+    def _find_spans(self):
+        loader = BaseStreamLoader(''.join(self._lines))
+        starts, names = [], []
+        end = len(self._lines)
+
+        try:
+            depth, key, items = 0, None, 0
+            while not loader.check_event(yaml.StreamEndEvent):
+                event = loader.get_event()
+
+                if isinstance(event, yaml.CollectionEndEvent):
+                    depth -= 1
+                    if depth == 0:
+                        end = event.start_mark.line + (1 if event.start_mark.column else 0)
+                    continue
+                if not isinstance(event, yaml.NodeEvent):
+                    continue
+
+                if depth == 0 and not isinstance(event, yaml.SequenceStartEvent):
+                    if not isinstance(event, yaml.ScalarEvent) or event.value:
+                        raise ConstructorError(None, None, "expected a list of peers", event.start_mark)
+                elif depth == 0 and event.flow_style:
+                    raise ConstructorError(None, None, "cannot patch a flow style list of peers", event.start_mark)
+                elif depth == 1:
+                    starts.append(event.start_mark.line)
+                    names.append(None)
+                    items = 0
+                elif depth == 2:
+                    # every other node of a peer mapping is a key
+                    if items % 2 == 0:
+                        key = getattr(event, 'value', None)
+                    elif key == 'name' and isinstance(event, yaml.ScalarEvent):
+                        names[-1] = event.value
+                    items += 1
+
+                if isinstance(event, yaml.CollectionStartEvent):
+                    depth += 1
+        finally:
+            loader.dispose()
+
+        # blank lines and comments after a peer separate it from the next
+        ends = [self._trim(start, next_start) for start, next_start in zip(starts, starts[1:] + [end])]
+
+        # comments directly above a peer belong to it
+        spans = []
+        for i, (start, end, name) in enumerate(zip(starts, ends, names)):
+            while i > 0 and start - 1 >= ends[i - 1] and self._lines[start - 1].startswith('#'):
+                start -= 1
+            spans.append((start, end, name))
+
+        return spans
+
+    def _trim(self, start, end):
+        while end > start + 1 and (not self._lines[end - 1].strip() or self._lines[end - 1].startswith('#')):
+            end -= 1
+        return end
+
+    def _dump(self, peer):
+        return yaml.dump([peer], Dumper=PeersDumper, sort_keys=False).splitlines(keepends=True)
+
+    def remove(self, position):
+        '''Remove the peer at position'''
+        self._replaced[position] = None
+
+    def replace(self, position, peer):
+        '''Replace the peer at position with peer'''
+        self._replaced[position] = self._dump(peer)
+
+    def insert(self, peer):
+        '''Insert peer in alphabetical order by name'''
+        position = bisect_right(self._names, str(peer['name']))
+        insort(self._inserted[position], (str(peer['name']), self._dump(peer)))
+
+    @property
+    def changed(self):
+        return bool(self._replaced or self._inserted)
+
+    def save(self):
+        '''Write the file with every change applied, if there are any'''
+        if not self.changed:
+            return False
+
+        blocks = []
+        for position in range(len(self._spans) + 1):
+            blocks += [(lines, None) for _, lines in self._inserted.get(position, [])]
+            if position == len(self._spans):
+                break
+
+            start, end, _ = self._spans[position]
+            lines = self._replaced.get(position, self._lines[start:end])
+            if lines is None:
+                continue
+
+            # keep the original lines between this peer and the next
+            separator = None
+            if position + 1 < len(self._spans):
+                separator = self._lines[end:self._spans[position + 1][0]]
+            blocks.append((lines, separator))
+
+        if self._spans:
+            prefix, suffix = self._lines[:self._spans[0][0]], self._lines[self._spans[-1][1]:]
+        else:
+            prefix, suffix = self._lines, []
+
+        with open(f'{self.filename}.tmp', 'w') as fd:
+            fd.writelines(prefix)
+            for i, (lines, separator) in enumerate(blocks):
+                fd.writelines(lines)
+                if i + 1 < len(blocks):
+                    fd.writelines(separator or ['\n'])
+            fd.writelines(suffix)
+
+        # replace the router file only once it is completely written
+        os.replace(f'{self.filename}.tmp', self.filename)
+        return True
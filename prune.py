@@ -1,10 +1,16 @@
 # Prune invalid peers from routers
+import argparse
 import os
 
-from routedbits import RoutedBits
-
-from interactive import load_router_peers, save_router_peers
-from validate_config import validate
+from model import load_peers
+from nodes import NodeCatalog
+from peer_index import normalize_asn
+from peerfile import PeerFile
+from registry import Registry
+from requests import RequestException
+from resolver import Resolver, is_retryable
+from shards import parse_shard, shard_routers
+from validate_config import catalog, registry, resolver, result_cache, validate_stream
 
 
 def add_report_entry(report, router, peer, errors):
@@ -16,50 +22,174 @@ def add_report_entry(report, router, peer, errors):
     return report[router]
 
 
+def add_contacts(entries, peers):
+    """
+    Add the AS name and admin contact of each removed peer from the
+    registry to its report entry, fetching them all at once
+    """
+    asns = [normalize_asn(peer.get("asn", "")) for peer in peers]
+    autnums = registry.asns_detail(asn for asn in asns if asn.isdigit())
+    persons = registry.persons_detail(autnum["admin-c"] for autnum in autnums.values() if "admin-c" in autnum)
+
+    for entry, asn in zip(entries, asns):
+        autnum = autnums.get(asn, {})
+        if "as-name" in autnum:
+            entry["as-name"] = autnum["as-name"]
+        if "admin-c" in autnum:
+            person = persons.get(autnum["admin-c"], {})
+            entry["contact"] = person.get("contact") or person.get("e-mail") or autnum["admin-c"]
+
+
+def format_report_entry(router, peers):
+    """Format the peers removed from one router for the report"""
+    lines = [f"### {router}"]
+    for peer in peers:
+        details = []
+        if "as-name" in peer:
+            details.append(peer["as-name"])
+        if "contact" in peer:
+            details.append(f"contact: {peer['contact']}")
+        lines.append(f"- {peer['name']} ({', '.join(details)})" if details else f"- {peer['name']}")
+        for reason in peer["reasons"]:
+            lines.append(f"  * {reason}")
+    return "\n".join(lines) + "\n"
+
+
 def print_report(report):
     """Print the contents of the report summary"""
     print("============ PRUNE REPORT ============")
 
     if len(report):
         for router, peers in report.items():
-            print(f"### {router}")
-            for peer in peers:
-                print(f"- {peer['name']}")
-                for reason in peer["reasons"]:
-                    print(f"  * {reason}")
-            print("")
+            print(format_report_entry(router, peers))
     else:
         print("No changes.")
 
 
-def main():
-    node_types = {
-        node["hostname"]: node["type"]
-        for node in RoutedBits().nodes(minimal=True)  # noqa
-    }
-    report = {}
+def router_peers(routers, node_types):
+    """Stream the peers of every router as (key, node_type, peer) items for validate_stream()"""
+    for router in routers:
+        for position, peer in enumerate(load_peers(f"routers/{router}.yml")):
+            yield (router, position, peer), node_types[router], peer
+
 
-    for yaml_file in sorted(os.listdir("routers")):
-        router = yaml_file[:-4]
-        peers = load_router_peers(router)
+def prune_routers(routers, results):
+    """
+    Group validate_stream() results by router, yielding (router, output,
+    invalid) as soon as each router is done, where invalid is a list of
+    (position, peer, errors) for the peers to remove. Peers failing only
+    on DNS timeouts are kept, they are checked again next run.
+    """
+    result = next(results, None)
 
-        print(f"------------ {router} ------------")
+    for router in routers:
+        output, invalid = "", []
+        while result and result[0][0] == router:
+            (_, position, peer), errors, peer_output = result
+            output += peer_output
 
-        if peers:
-            node_type = node_types[router]
+            if errors and not all(is_retryable(e) for e in errors):
+                invalid.append((position, peer, errors))
 
-            for peer in peers:
-                errors = list(validate(node_type, peer))
-                is_invalid = bool(len(errors))
+            result = next(results, None)
 
-                if is_invalid:
-                    add_report_entry(report, router, peer, errors)
-                    peers.remove(peer)
+        yield router, output, invalid
+
+
+def main(args):
+    registry.max_age = args.registry_max_age
+    catalog.max_age = args.nodes_max_age
+    resolver.timeout = args.dns_timeout
+    resolver.budget = args.dns_budget
+
+    node_types = catalog.node_types()
+    report = {}
 
-            save_router_peers(router, peers)
+    yaml_files = sorted(os.listdir("routers"))
+    if args.shard:
+        yaml_files = shard_routers(yaml_files, args.shard)
+
+    # peers cannot be validated without their router's node type, leave those routers as they are
+    routers = []
+    for yaml_file in yaml_files:
+        if yaml_file[:-4] in node_types:
+            routers.append(yaml_file[:-4])
+        else:
+            print(f"Skipping {yaml_file[:-4]}: no entry in the RoutedBits node catalog")
+
+    resolver.load_cache(args.dns_cache, max_age=args.dns_max_age, refresh=args.refresh_dns)
+    result_cache.load(args.result_cache, refresh=args.refresh_results)
+
+    results = validate_stream(router_peers(routers, node_types), jobs=args.jobs)
+
+    contacts = args.contacts
+    report_file = open(args.report, "w") if args.report else None
+    try:
+        for router, output, invalid in prune_routers(routers, results):
+            print(f"------------ {router} ------------")
+            print(output, end="")
+
+            if not invalid:
+                continue
+
+            # remove only the invalid peers' lines, leaving the rest of the file as is
+            router_file = PeerFile(f"routers/{router}.yml")
+            for position, peer, errors in invalid:
+                router_file.remove(position)
+                add_report_entry(report, router, peer, errors)
+            router_file.save()
+
+            if contacts:
+                try:
+                    add_contacts(report[router], [peer for _, peer, _ in invalid])
+                except RequestException as e:
+                    # already retried, the registry is not coming back for the other routers
+                    print(f"Leaving out contacts, the registry could not be reached: {e}")
+                    contacts = False
+
+            if report_file:
+                report_file.write(format_report_entry(router, report[router]) + "\n")
+                report_file.flush()
+
+        if report_file and not report:
+            report_file.write("No changes.\n")
+    finally:
+        if report_file:
+            report_file.close()
+
+    resolver.save_cache()
+    result_cache.save()
 
     print_report(report)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Prune invalid dn42-peers")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+            help="Number of processes to validate peers with (default: number of CPUs)")
+    parser.add_argument("--report", metavar="FILE",
+            help="Also write the report to a file, one router at a time as each is pruned")
+    parser.add_argument("--shard", metavar="i/N", type=parse_shard,
+            help="Only prune the i-th of N shards of the routers, balanced by peers and DNS endpoints")
+    parser.add_argument("--contacts", action="store_true",
+            help="Add the AS name and admin contact of removed peers to the report, from the registry")
+    parser.add_argument("--dns-cache", default=".cache/dns.json",
+            help="File to keep DNS answers in between runs")
+    parser.add_argument("--dns-max-age", type=int, default=Resolver.MAX_AGE,
+            help="Maximum seconds to reuse a cached DNS answer, regardless of TTL")
+    parser.add_argument("--dns-timeout", type=float, default=Resolver.TIMEOUT,
+            help="Seconds to wait for one DNS lookup")
+    parser.add_argument("--dns-budget", type=float, default=Resolver.BUDGET,
+            help="Seconds all DNS lookups may take together; lookups left after it time out")
+    parser.add_argument("--refresh-dns", action="store_true",
+            help="Ignore cached DNS answers and resolve everything again")
+    parser.add_argument("--result-cache", default=".cache/results.json",
+            help="File to keep validation results of unchanged peers in between runs")
+    parser.add_argument("--refresh-results", action="store_true",
+            help="Ignore cached validation results and validate every peer again")
+    parser.add_argument("--registry-max-age", type=int, default=Registry.MAX_AGE,
+            help="Maximum seconds to use the registry snapshot before refreshing it")
+    parser.add_argument("--nodes-max-age", type=int, default=NodeCatalog.MAX_AGE,
+            help="Maximum seconds to use the node catalog snapshot before refreshing it")
+    args = parser.parse_args()
+    main(args)
@@ -2,7 +2,18 @@
 #
 #
 
-from requests import Session
+import json
+import os
+import threading
+import time
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 
 class RegistryNotFound(Exception):
@@ -10,15 +21,83 @@ class RegistryNotFound(Exception):
         super().__init__('Object Not Found')
 
 
+class ASNIndex(object):
+    '''
+    Sorted array of registered AS numbers
+
+    Built from the aut-num list ['AS4242420207', ...] and answers
+    membership and range lookups by bisection
+    '''
+
+    def __init__(self, asns):
+        self._asns = array('L', sorted({
+            int(asn[2:]) for asn in asns if asn.startswith('AS') and asn[2:].isdigit()
+        }))
+
+    def __len__(self):
+        return len(self._asns)
+
+    def __contains__(self, asn):
+        # accept anything that formats to AS<number> in the registry
+        asn = str(asn)
+        if not asn.isascii() or not asn.isdigit() or str(int(asn)) != asn:
+            return False
+
+        i = bisect_left(self._asns, int(asn))
+        return i < len(self._asns) and self._asns[i] == int(asn)
+
+    def range(self, first, last):
+        '''Registered AS numbers from first to last (inclusive)'''
+        return self._asns[bisect_left(self._asns, first):bisect_right(self._asns, last)].tolist()
+
+
 class Registry(object):
+    '''
+    Client of the registry API
+
+    Requests share a pool of max_workers connections, give up after
+    timeout seconds (connect, read) and are retried with exponential
+    backoff when the connection fails or the registry is overloaded.
+    Objects fetched with asn()/person() are kept in an LRU cache of
+    cache_size entries; asns_detail()/persons_detail() fetch many of
+    them concurrently, at most max_workers at a time.
+    '''
     BASE = 'https://explorer.dn42.dev/api/registry'
 
-    def __init__(self):
+    # Local copy of the aut-num list, see asns()
+    SNAPSHOT = '.cache/registry.json'
+    MAX_AGE = 3600
+
+    MAX_WORKERS = 8
+    TIMEOUT = (5, 30)
+    RETRIES = Retry(
+        total=3, backoff_factor=0.25, status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET'], raise_on_status=False,
+    )
+    CACHE_SIZE = 1024
+
+    def __init__(self, base=BASE, snapshot=SNAPSHOT, max_age=MAX_AGE,
+                 max_workers=MAX_WORKERS, timeout=TIMEOUT, retries=RETRIES, cache_size=CACHE_SIZE):
+        self.base = base
+        self.snapshot = snapshot
+        self.max_age = max_age
+        self.timeout = timeout
+        self._max_workers = max_workers
         self._session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retries)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._pool = None
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._snapshot = None
+        self._asn_index = None
+        self._lock = threading.Lock()
 
-    def _request(self, method, path, params=None, data=None):
-        url = f'{self.BASE}{path}'
-        resp = self._session.request(method, url, params=params, json=data)
+    def _request(self, method, path, params=None, data=None, headers=None):
+        url = f'{self.base}{path}'
+        resp = self._session.request(method, url, params=params, json=data, headers=headers, timeout=self.timeout)
         if resp.status_code == 404:
             raise RegistryNotFound()
         resp.raise_for_status()
@@ -41,20 +120,146 @@ class Registry(object):
 
         return data
 
+    def _load_snapshot(self):
+        if self._snapshot:
+            return self._snapshot
+        if not self.snapshot or not os.path.exists(self.snapshot):
+            return None
+
+        with open(self.snapshot, 'r') as fd:
+            try:
+                snapshot = json.load(fd)
+            except ValueError:
+                return None
+
+        # anything else is fetched again
+        if not isinstance(snapshot, dict) or 'fetched' not in snapshot or 'aut-num' not in snapshot:
+            return None
+
+        self._snapshot = snapshot
+        return self._snapshot
+
+    def _save_snapshot(self, snapshot):
+        self._snapshot = snapshot
+        if not self.snapshot:
+            return
+
+        os.makedirs(os.path.dirname(self.snapshot) or '.', exist_ok=True)
+        with open(f'{self.snapshot}.tmp', 'w') as fd:
+            json.dump(snapshot, fd)
+        os.replace(f'{self.snapshot}.tmp', self.snapshot)
+
     def asns(self):
+        '''
+        List of every aut-num in the registry
+
+        Served from the local snapshot while it is younger than max_age,
+        otherwise refreshed with a conditional GET. When the registry
+        cannot be reached the snapshot is used regardless of its age.
+        '''
         path = '/aut-num'
-        return self._request('GET', path).json()['aut-num']
+        snapshot = self._load_snapshot()
+
+        if snapshot and time.time() - snapshot['fetched'] < self.max_age:
+            return snapshot['aut-num']
+
+        headers = {}
+        if snapshot and snapshot.get('etag'):
+            headers['If-None-Match'] = snapshot['etag']
+        if snapshot and snapshot.get('last_modified'):
+            headers['If-Modified-Since'] = snapshot['last_modified']
+
+        try:
+            resp = self._request('GET', path, headers=headers)
+        except RequestException:
+            if snapshot:
+                return snapshot['aut-num']
+            raise
+
+        if resp.status_code != 304:
+            snapshot = {
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'aut-num': resp.json()['aut-num'],
+            }
+        snapshot['fetched'] = time.time()
+        self._save_snapshot(snapshot)
+
+        return snapshot['aut-num']
+
+    def asn_index(self):
+        '''
+        ASNIndex of asns(), rebuilt only when the snapshot changes. Safe
+        to call from several threads; only one of them fetches.
+        '''
+        with self._lock:
+            asns = self.asns()
+            if self._asn_index is None or self._asn_index[0] is not asns:
+                self._asn_index = (asns, ASNIndex(asns))
+            return self._asn_index[1]
+
+    def _fetch_object(self, kind, name):
+        '''The object as a tuple of (key, value) pairs, to cache'''
+        path = f'/{kind}/{name}?raw'
+        resp = self._request('GET', path).json()
+        try:
+            return tuple((key, value) for key, value in resp[f'{kind}/{name}'])
+        except (KeyError, TypeError, ValueError):
+            # malformed, no object to read
+            raise RegistryNotFound()
+
+    def _object(self, kind, name):
+        '''
+        The object as a dict, fetched once while it stays among the
+        cache_size most recently used. Every call gets a dict of its own.
+        '''
+        key = (kind, name)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._transform_response(self._cache[key])
+
+        pairs = self._fetch_object(kind, name)
+        with self._cache_lock:
+            self._cache[key] = pairs
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return self._transform_response(pairs)
+
+    def _objects(self, kind, names):
+        '''
+        Fetch many objects concurrently, as a dict by name of those
+        found; other failures are raised
+        '''
+        def fetch(name):
+            try:
+                return self._object(kind, name)
+            except RegistryNotFound:
+                return None
+
+        names = list(dict.fromkeys(names))
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self._max_workers)
+
+        objects = zip(names, self._pool.map(fetch, names))
+        return {name: obj for name, obj in objects if obj is not None}
 
     def asn(self, asn):
-        path = f'/aut-num/AS{asn}?raw'
-        resp = self._request('GET', path).json()[f'aut-num/AS{asn}']
-        return self._transform_response(resp)
+        return self._object('aut-num', f'AS{asn}')
+
+    def asns_detail(self, asns):
+        '''aut-num objects of several ASNs, by ASN, leaving out unregistered ones'''
+        asns = list(dict.fromkeys(asns))
+        objects = self._objects('aut-num', [f'AS{asn}' for asn in asns])
+        return {asn: objects[f'AS{asn}'] for asn in asns if f'AS{asn}' in objects}
 
     def persons(self):
         path = '/person'
         return self._request('GET', path).json()['person']
 
     def person(self, name):
-        path = f'/person/{name}?raw'
-        resp = self._request('GET', path).json()[f'person/{name}']
-        return self._transform_response(resp)
+        return self._object('person', name)
+
+    def persons_detail(self, names):
+        '''person objects of several names, by name, leaving out unknown ones'''
+        return self._objects('person', names)
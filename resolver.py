@@ -0,0 +1,260 @@
+#
+# DNS resolution for wireguard endpoints
+#
+
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+import ipaddress
+import json
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def endpoint_hostnames(peers):
+    '''
+    Collect every wireguard.remote_address that is a hostname
+    (not an IP address) from a list of peers
+    '''
+    hostnames = set()
+    for peer in peers:
+        wg = peer.get('wireguard')
+        if not isinstance(wg, dict) or not isinstance(wg.get('remote_address'), str):
+            continue
+
+        try:
+            ipaddress.ip_address(wg['remote_address'])
+        except ValueError:
+            hostnames.add(wg['remote_address'])
+
+    return hostnames
+
+
+# Validation error of a lookup that timed out; it says nothing about
+# the peer, the same run may pass when retried
+DNS_TIMEOUT_ERROR = 'wireguard.remote_address: DNS lookup timed out, retry later'
+
+
+def is_timeout(error):
+    '''Whether a DNS error is a timeout, worth retrying later'''
+    return isinstance(error, dns.exception.Timeout)
+
+
+def is_retryable(error):
+    '''Whether a validation error, with or without its file:line prefix, is only a DNS timeout'''
+    return error.endswith(DNS_TIMEOUT_ERROR)
+
+
+class Resolver(object):
+    '''
+    Resolves A/AAAA records, remembering every answer (or DNS error)
+    so each hostname is only looked up once per run
+
+    submit() starts resolving hostnames concurrently in the background,
+    resolve() then answers from the results, waiting for lookups still
+    in flight. With load_cache() answers are also kept on disk between
+    runs for as long as their TTL allows.
+
+    Each lookup gives up after timeout seconds, and once budget seconds
+    have passed since the first lookup every lookup left fails at once;
+    both fail with dns.exception.Timeout, see is_timeout(). Lookups go
+    through stub.resolve(), dns.resolver (the system resolver) unless
+    another stub resolver, e.g. a dns.resolver.Resolver, is given.
+    '''
+    RDTYPES = ('AAAA', 'A')
+
+    # Seconds for one lookup, and for all lookups of a run
+    TIMEOUT = 5.0
+    BUDGET = 300.0
+
+    # Negative answers that are safe to keep on disk; anything else
+    # (timeouts, no nameservers) is transient and retried next run
+    NEGATIVE = {
+        'NXDOMAIN': dns.resolver.NXDOMAIN,
+        'NoAnswer': dns.resolver.NoAnswer,
+    }
+
+    # Used when a negative answer carries no SOA to take the TTL from
+    NEGATIVE_TTL = 300
+
+    # Upper bound on how long any answer is reused, regardless of TTL
+    MAX_AGE = 86400
+
+    def __init__(self, max_workers=32, timeout=TIMEOUT, budget=BUDGET, stub=None):
+        self.timeout = timeout
+        self.budget = budget
+        self._stub = stub
+        self._deadline = None
+        self._max_workers = max_workers
+        self._answers = {}
+        self._pending = {}
+        self._pool = None
+        self._cache = {}
+        self._cache_file = None
+
+    def _negative_ttl(self, error):
+        try:
+            if isinstance(error, dns.resolver.NXDOMAIN):
+                responses = error.responses().values()
+            else:
+                responses = [error.response()]
+        except (AttributeError, KeyError):
+            return self.NEGATIVE_TTL
+
+        for response in responses:
+            for rrset in response.authority:
+                if rrset.rdtype == dns.rdatatype.SOA:
+                    return min(rrset.ttl, rrset[0].minimum)
+
+        return self.NEGATIVE_TTL
+
+    def _lifetime(self):
+        if self.budget is None:
+            return self.timeout
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.budget
+        return min(self.timeout, self._deadline - time.monotonic())
+
+    def _query(self, hostname, rdtype):
+        lifetime = self._lifetime()
+        if lifetime <= 0:
+            return dns.exception.Timeout(f'DNS budget of {self.budget} seconds spent')
+
+        try:
+            answer = (self._stub or dns.resolver).resolve(hostname, rdtype, lifetime=lifetime)
+            addresses = [rdata.address for rdata in answer]
+            self._cache[(hostname, rdtype)] = {
+                'fetched': time.time(), 'ttl': answer.rrset.ttl, 'addresses': addresses
+            }
+            return addresses
+        except dns.exception.DNSException as e:
+            if type(e).__name__ in self.NEGATIVE:
+                self._cache[(hostname, rdtype)] = {
+                    'fetched': time.time(), 'ttl': self._negative_ttl(e), 'error': type(e).__name__
+                }
+            return e
+
+    def load_cache(self, filename, max_age=MAX_AGE, refresh=False):
+        '''
+        Answer from (and later save to) an on-disk cache. Entries are
+        used until their TTL or max_age seconds run out, whichever
+        comes first; refresh ignores what is already on disk.
+        '''
+        self._cache_file = filename
+        if refresh or not os.path.exists(filename):
+            return
+
+        with open(filename, 'r') as fd:
+            try:
+                entries = json.load(fd)
+            except ValueError:
+                return
+
+        now = time.time()
+        for key, entry in entries.items():
+            hostname, rdtype = key.rsplit('/', 1)
+            if now >= entry['fetched'] + min(entry['ttl'], max_age):
+                continue
+
+            self._cache[(hostname, rdtype)] = entry
+            if 'error' in entry:
+                self._answers[(hostname, rdtype)] = self.NEGATIVE[entry['error']]()
+            else:
+                self._answers[(hostname, rdtype)] = entry['addresses']
+
+    def save_cache(self):
+        if not self._cache_file:
+            return
+
+        os.makedirs(os.path.dirname(self._cache_file) or '.', exist_ok=True)
+        entries = {f'{hostname}/{rdtype}': entry for (hostname, rdtype), entry in sorted(self._cache.items())}
+
+        with open(f'{self._cache_file}.tmp', 'w') as fd:
+            json.dump(entries, fd, indent=2)
+        os.replace(f'{self._cache_file}.tmp', self._cache_file)
+
+    def submit(self, hostnames, rdtypes=RDTYPES, retry=False):
+        '''
+        Start resolving hostnames in the background. A lookup that timed
+        out keeps failing for the rest of the run, unless retried.
+        '''
+        queries = {(h, t) for h in hostnames for t in rdtypes}
+        if retry:
+            for query in queries:
+                if is_timeout(self._answers.get(query)):
+                    del self._answers[query]
+
+        queries = sorted(queries - self._answers.keys() - self._pending.keys())
+        if not queries:
+            return
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self._max_workers)
+
+        for query in queries:
+            self._pending[query] = self._pool.submit(self._query, *query)
+
+    def prefetch(self, hostnames, rdtypes=RDTYPES):
+        '''Resolve hostnames concurrently, waiting for every answer'''
+        self.answers(hostnames, rdtypes)
+
+    def answers(self, hostnames, rdtypes=RDTYPES):
+        '''
+        Answers for hostnames, as accepted by add_answers(), to hand
+        them to another process
+        '''
+        hostnames = set(hostnames)
+        self.submit(hostnames, rdtypes)
+
+        answers = {}
+        for h in hostnames:
+            for t in rdtypes:
+                answer = self._answer(h, t)
+                if isinstance(answer, dns.exception.DNSException):
+                    # dnspython exceptions with kwargs do not survive pickling
+                    kind = dns.exception.Timeout if is_timeout(answer) else dns.exception.DNSException
+                    answer = kind(str(answer))
+                answers[(h, t)] = answer
+        return answers
+
+    def answer_key(self, hostname, rdtypes=RDTYPES):
+        '''
+        The answers for hostname as plain data, to key results derived
+        from them, or None when a lookup failed for a transient reason
+        '''
+        key = []
+        for rdtype in rdtypes:
+            answer = self._answer(hostname, rdtype)
+            if isinstance(answer, dns.exception.DNSException):
+                if type(answer).__name__ not in self.NEGATIVE:
+                    return None
+                answer = type(answer).__name__
+            else:
+                answer = sorted(answer)
+            key.append([rdtype, answer])
+
+        return key
+
+    def add_answers(self, answers):
+        self._answers.update(answers)
+
+    def _answer(self, hostname, rdtype):
+        key = (hostname, rdtype)
+        if key in self._pending:
+            self._answers[key] = self._pending.pop(key).result()
+        elif key not in self._answers:
+            self._answers[key] = self._query(hostname, rdtype)
+
+        return self._answers[key]
+
+    def resolve(self, hostname, rdtype):
+        '''
+        Return the list of addresses for hostname, raising the
+        dns.exception.DNSException the lookup failed with
+        '''
+        answer = self._answer(hostname, rdtype)
+        if isinstance(answer, dns.exception.DNSException):
+            raise answer
+        return answer
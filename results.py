@@ -0,0 +1,72 @@
+#
+# Validation results kept between runs
+#
+
+import hashlib
+import json
+import os
+import time
+
+
+class ResultCache(object):
+    '''
+    Validation results (errors and progress output) of peers, keyed by
+    a hash of everything a result depends on
+
+    Since any change to those inputs makes a different key, entries are
+    never invalidated, only dropped once they have gone unused for
+    max_age seconds.
+    '''
+    MAX_AGE = 30 * 86400
+
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self._entries = {}
+        self._cache_file = None
+
+    @staticmethod
+    def key(*inputs):
+        '''Hash of inputs, which must be JSON serializable'''
+        data = json.dumps(inputs, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def get(self, key):
+        '''(errors, output) stored for key, or None'''
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        entry['used'] = time.time()
+        return entry['errors'], entry['output']
+
+    def put(self, key, errors, output):
+        self._entries[key] = {'used': time.time(), 'errors': list(errors), 'output': output}
+
+    def load(self, filename, refresh=False):
+        '''
+        Use (and later save to) an on-disk cache; refresh ignores what
+        is already on disk
+        '''
+        self._cache_file = filename
+        if refresh or not os.path.exists(filename):
+            return
+
+        with open(filename, 'r') as fd:
+            try:
+                entries = json.load(fd)
+            except ValueError:
+                return
+
+        now = time.time()
+        self._entries.update({
+            key: entry for key, entry in entries.items() if now < entry['used'] + self.max_age
+        })
+
+    def save(self):
+        if not self._cache_file:
+            return
+
+        os.makedirs(os.path.dirname(self._cache_file) or '.', exist_ok=True)
+        with open(f'{self._cache_file}.tmp', 'w') as fd:
+            json.dump(self._entries, fd)
+        os.replace(f'{self._cache_file}.tmp', self._cache_file)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#
+# Split routers across CI runners and merge the results of each shard
+#
+
+import argparse
+import heapq
+
+from resolver import endpoint_hostnames, is_retryable
+from snapshot import load_snapshot
+
+
+def parse_shard(value):
+    '''argparse type for i/N, the i-th (counting from 1) of N shards'''
+    try:
+        index, count = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not in the form i/N")
+
+    if not 0 < index <= count:
+        raise argparse.ArgumentTypeError(f"shard {index} is not between 1 and {count}")
+    return index, count
+
+
+def router_weight(peers):
+    '''Peers of a router plus the DNS endpoints they need resolved'''
+    peers = list(peers)
+    return len(peers) + len(endpoint_hostnames(peers))
+
+
+def assign_shards(weights, count):
+    '''
+    Map each name in weights to a shard (from 0), giving the heaviest
+    remaining name to the lightest shard. Ties are broken by name and
+    shard number so every runner computes the same assignment.
+    '''
+    shards = [(0, i) for i in range(count)]
+    assignment = {}
+
+    for name in sorted(weights, key=lambda name: (-weights[name], name)):
+        load, i = heapq.heappop(shards)
+        assignment[name] = i
+        heapq.heappush(shards, (load + weights[name], i))
+
+    return assignment
+
+
+def shard_routers(yaml_files, shard, snapshot=None):
+    '''The router files (e.g. router.lon1.yml) of one shard, from parse_shard()'''
+    index, count = shard
+    # a router file that does not parse has no peers in the snapshot,
+    # it is reported by whichever shard gets it
+    if snapshot is None:
+        snapshot = load_snapshot()
+    weights = {f: router_weight(peer for _, peer in snapshot.peers(f[:-4])) for f in yaml_files}
+    assignment = assign_shards(weights, count)
+    return [f for f in yaml_files if assignment[f] == index - 1]
+
+
+def merge_errors(filenames):
+    '''Combine validate_config.py --errors files, ordered by router file'''
+    errors = []
+    for filename in filenames:
+        with open(filename, 'r') as fd:
+            errors += fd.read().splitlines()
+
+    # stable, so each router's errors stay in line order
+    return sorted(errors, key=lambda e: e.split(':', 1)[0])
+
+
+def merge_reports(filenames):
+    '''Combine prune.py --report files into one report, ordered by router'''
+    sections = {}
+    for filename in filenames:
+        with open(filename, 'r') as fd:
+            for section in fd.read().split('### ')[1:]:
+                sections[section.split('\n', 1)[0]] = f'### {section.rstrip()}\n'
+
+    if not sections:
+        return 'No changes.\n'
+    return ''.join(f'{sections[router]}\n' for router in sorted(sections))
+
+
+def main(args):
+    if args.command == 'errors':
+        errors = merge_errors(args.files)
+        for e in errors:
+            print(e)
+        if errors:
+            # as validate_config.py exits, 3 when only DNS timeouts failed
+            exit(3 if all(is_retryable(e) for e in errors) else 2)
+        exit(0)
+
+    if args.command == 'report':
+        print(merge_reports(args.files), end='')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge the results of sharded dn42-peers runs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    errors = subparsers.add_parser('errors', help='Combine validate_config.py --errors files')
+    errors.add_argument('files', nargs='+', help='Error files of every shard')
+
+    report = subparsers.add_parser('report', help='Combine prune.py --report files')
+    report.add_argument('files', nargs='+', help='Report files of every shard')
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+#
+# Compiled, memory-mapped snapshot of every router's peers
+#
+
+import argparse
+import hashlib
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import yaml
+
+from array import array
+from peerfile import iter_peers
+
+SNAPSHOT = '.cache/peers.snapshot'
+
+MAGIC = b'DN42PEER'
+FORMAT = 1
+
+# value of a prefix length column when the attribute is missing or not an address
+MISSING = -2
+
+# bits of the flags column
+SESSIONS, SESSION_IPV4, SESSION_IPV6, MULTIPROTOCOL, EXTENDED_NEXTHOP = (1 << i for i in range(5))
+
+# one entry per peer; strings are ids into the interned string table,
+# ints are -1 when the attribute is missing or of the wrong type
+COLUMNS = [
+    ('line', 'I'),
+    ('name', 'i'),
+    ('asn', 'q'),
+    ('ipv4', 'I'), ('ipv4_prefix', 'b'),
+    ('local_ipv4', 'I'), ('local_ipv4_prefix', 'b'),
+    ('ipv6_high', 'Q'), ('ipv6_low', 'Q'), ('ipv6_prefix', 'h'),
+    ('local_ipv6_high', 'Q'), ('local_ipv6_low', 'Q'), ('local_ipv6_prefix', 'h'),
+    ('remote_address', 'i'),
+    ('remote_port', 'i'),
+    ('public_key', 'i'),
+    ('flags', 'B'),
+]
+
+
+def source_hashes(routers='routers'):
+    '''sha256 of every router file, by file name'''
+    hashes = {}
+    for yaml_file in sorted(os.listdir(routers)):
+        if yaml_file.endswith('.yml'):
+            with open(f'{routers}/{yaml_file}', 'rb') as fd:
+                hashes[yaml_file] = hashlib.sha256(fd.read()).hexdigest()
+    return hashes
+
+
+def _int(value, bits=63):
+    '''value (or an ASN like AS4242420207) as a non-negative int column value, or -1'''
+    if isinstance(value, bool):
+        return -1
+    try:
+        value = int(str(value).strip().upper().removeprefix('AS'))
+    except ValueError:
+        return -1
+    return value if 0 <= value < 2**bits else -1
+
+
+def _address(value, version):
+    '''(integer, prefix length or -1) of a tunnel address, or None'''
+    try:
+        interface = ipaddress.ip_interface(str(value))
+    except ValueError:
+        return None
+    if interface.version != version:
+        return None
+    return int(interface.ip), interface.network.prefixlen if '/' in str(value) else -1
+
+
+class _Compiler(object):
+    def __init__(self):
+        self.columns = {name: array(typecode) for name, typecode in COLUMNS}
+        self.strings = {}
+
+    def intern(self, value):
+        if not isinstance(value, str):
+            return -1
+        return self.strings.setdefault(value, len(self.strings))
+
+    def add(self, peer):
+        if not isinstance(peer, dict):
+            peer = {}
+        c = self.columns
+
+        c['line'].append(peer.get('__line__', 0))
+        c['name'].append(self.intern(peer.get('name')))
+        c['asn'].append(_int(peer['asn']) if 'asn' in peer else -1)
+
+        for attrib in ['ipv4', 'local_ipv4']:
+            address = _address(peer[attrib], 4) if attrib in peer else None
+            c[attrib].append(address[0] if address else 0)
+            c[f'{attrib}_prefix'].append(address[1] if address else MISSING)
+
+        for attrib in ['ipv6', 'local_ipv6']:
+            address = _address(peer[attrib], 6) if attrib in peer else None
+            c[f'{attrib}_high'].append(address[0] >> 64 if address else 0)
+            c[f'{attrib}_low'].append(address[0] & (2**64 - 1) if address else 0)
+            c[f'{attrib}_prefix'].append(address[1] if address else MISSING)
+
+        wg = peer.get('wireguard') if isinstance(peer.get('wireguard'), dict) else {}
+        c['remote_address'].append(self.intern(wg.get('remote_address')))
+        c['remote_port'].append(_int(wg['remote_port'], bits=31) if isinstance(wg.get('remote_port'), int) else -1)
+        c['public_key'].append(self.intern(wg.get('public_key')))
+
+        flags = 0
+        sessions = peer.get('sessions')
+        if isinstance(sessions, list):
+            flags |= SESSIONS
+            flags |= SESSION_IPV4 if 'ipv4' in sessions else 0
+            flags |= SESSION_IPV6 if 'ipv6' in sessions else 0
+        flags |= MULTIPROTOCOL if peer.get('multiprotocol') is True else 0
+        flags |= EXTENDED_NEXTHOP if peer.get('extended_nexthop') is True else 0
+        c['flags'].append(flags)
+
+
+def compile_snapshot(filename=SNAPSHOT, routers='routers', sources=None):
+    '''
+    Compile every router file into a snapshot, returning its contents.
+    A file that does not parse has no peers in the snapshot,
+    validate_config reports it.
+    '''
+    sources = source_hashes(routers) if sources is None else sources
+    compiler = _Compiler()
+    ranges = []
+
+    for yaml_file in sources:
+        start = len(compiler.columns['line'])
+        try:
+            for peer in iter_peers(f'{routers}/{yaml_file}'):
+                compiler.add(peer)
+        except yaml.YAMLError:
+            for column in compiler.columns.values():
+                del column[start:]
+        ranges.append([yaml_file[:-4], start, len(compiler.columns['line']) - start])
+
+    # interned strings are one blob with the offset of each
+    blob = bytearray()
+    offsets = array('I', [0])
+    for string in compiler.strings:
+        blob += string.encode()
+        offsets.append(len(blob))
+
+    data = [(name, column.typecode, column.tobytes()) for name, column in compiler.columns.items()]
+    data += [('string_offsets', 'I', offsets.tobytes()), ('strings', 'B', bytes(blob))]
+
+    # columns are 8 byte aligned, offsets count from the end of the header
+    columns, position = {}, 0
+    for name, typecode, content in data:
+        columns[name] = [typecode, position, len(content)]
+        position += -(-len(content) // 8) * 8
+
+    header = json.dumps({
+        'format': FORMAT, 'byteorder': sys.byteorder, 'sources': sources,
+        'routers': ranges, 'columns': columns,
+    }).encode()
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    contents = MAGIC + struct.pack('<Q', len(header)) + header
+    contents += b''.join(content + b'\0' * (-len(content) % 8) for _, _, content in data)
+
+    # a temporary file of our own, as other runs may compile at the same time
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(filename) or '.', prefix='.peers-', delete=False) as fd:
+        fd.write(contents)
+    try:
+        os.replace(fd.name, filename)
+    except OSError:
+        os.remove(fd.name)
+        raise
+
+    return contents
+
+
+class Snapshot(object):
+    '''
+    A compiled snapshot, memory-mapped so only the columns and strings
+    used are read, or read from the contents compile_snapshot() returned. Peers come back as dicts of the indexed fields
+    (name, asn, tunnel addresses, wireguard endpoint and key, sessions),
+    with addresses in canonical form, for RouterIndex, PrefixIndex and
+    GlobalIndex. Values that do not parse are left out.
+    '''
+    def __init__(self, filename=SNAPSHOT, contents=None):
+        if contents is not None:
+            self._mmap = contents
+        else:
+            with open(filename, 'rb') as fd:
+                self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{filename} is not a peers snapshot')
+        length, = struct.unpack_from('<Q', self._mmap, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self._mmap[start:start + length])
+        if header['format'] != FORMAT or header['byteorder'] != sys.byteorder:
+            raise ValueError(f'{filename} is from another version or machine')
+
+        self.sources = header['sources']
+        self._routers = {router: (first, count) for router, first, count in header['routers']}
+
+        view = memoryview(self._mmap)
+        self._columns = {}
+        for name, (typecode, offset, size) in header['columns'].items():
+            offset += start + length
+            self._columns[name] = view[offset:offset + size].cast(typecode)
+
+        self._strings = {}
+
+    def __len__(self):
+        return len(self._columns['line'])
+
+    @property
+    def routers(self):
+        return list(self._routers)
+
+    def string(self, i):
+        if i < 0:
+            return None
+        if i not in self._strings:
+            offsets = self._columns['string_offsets']
+            self._strings[i] = bytes(self._columns['strings'][offsets[i]:offsets[i + 1]]).decode()
+        return self._strings[i]
+
+    def _address(self, attrib, row, version):
+        c = self._columns
+        prefix = c[f'{attrib}_prefix'][row]
+        if prefix == MISSING:
+            return None
+
+        if version == 4:
+            address = ipaddress.IPv4Address(c[attrib][row])
+        else:
+            address = ipaddress.IPv6Address(c[f'{attrib}_high'][row] << 64 | c[f'{attrib}_low'][row])
+        return str(address) if prefix < 0 else f'{address}/{prefix}'
+
+    def peer(self, row):
+        '''The peer in a row, as a dict of the indexed fields'''
+        c = self._columns
+        peer = {'__line__': c['line'][row]}
+
+        if (name := self.string(c['name'][row])) is not None:
+            peer['name'] = name
+        if c['asn'][row] >= 0:
+            peer['asn'] = c['asn'][row]
+
+        for attrib, version in [('ipv4', 4), ('ipv6', 6), ('local_ipv4', 4), ('local_ipv6', 6)]:
+            if (address := self._address(attrib, row, version)) is not None:
+                peer[attrib] = address
+
+        flags = c['flags'][row]
+        if flags & SESSIONS:
+            peer['sessions'] = [af for af, flag in [('ipv4', SESSION_IPV4), ('ipv6', SESSION_IPV6)] if flags & flag]
+        if flags & MULTIPROTOCOL:
+            peer['multiprotocol'] = True
+        if flags & EXTENDED_NEXTHOP:
+            peer['extended_nexthop'] = True
+
+        wg = {}
+        if (remote_address := self.string(c['remote_address'][row])) is not None:
+            wg['remote_address'] = remote_address
+        if c['remote_port'][row] >= 0:
+            wg['remote_port'] = c['remote_port'][row]
+        if (public_key := self.string(c['public_key'][row])) is not None:
+            wg['public_key'] = public_key
+        if wg:
+            peer['wireguard'] = wg
+
+        return peer
+
+    def peers(self, router=None):
+        '''(router, peer) of every peer, or of one router, in file order'''
+        routers = [router] if router else self._routers
+        for router in routers:
+            first, count = self._routers.get(router, (0, 0))
+            for row in range(first, first + count):
+                yield router, self.peer(row)
+
+    def asn_peers(self, asn):
+        '''(router, peer) of every peer of an ASN, scanning only the ASN column'''
+        asn, column = _int(asn), self._columns['asn']
+        for router, (first, count) in self._routers.items():
+            for row in range(first, first + count):
+                if column[row] == asn:
+                    yield router, self.peer(row)
+
+
+def load_snapshot(filename=SNAPSHOT, routers='routers'):
+    '''The snapshot of routers, compiled again if any router file changed'''
+    sources = source_hashes(routers)
+    try:
+        snapshot = Snapshot(filename)
+        if snapshot.sources == sources:
+            return snapshot
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # what was just compiled, rather than the file another run may be replacing
+    return Snapshot(filename, compile_snapshot(filename, routers, sources))
+
+
+def main(args):
+    start = time.perf_counter()
+    snapshot = load_snapshot(args.snapshot)
+    peers = sum(1 for _ in snapshot.peers())
+    print(f'{len(snapshot.routers)} routers, {peers} peers read in {(time.perf_counter() - start) * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile the router files into a peers snapshot')
+    parser.add_argument('--snapshot', default=SNAPSHOT, help='Snapshot file')
+    args = parser.parse_args()
+    main(args)
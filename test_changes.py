@@ -0,0 +1,75 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from changes import base_peers, changed_peers, changed_routers, merge_base
+from validate_config import read_yaml
+
+PEER_A = '''- name: PEER-A
+  asn: 4242420001
+  ipv6: fe80::1
+  sessions:
+    - ipv6
+'''
+
+PEER_B = '''- name: PEER-B
+  asn: 4242420002
+  ipv6: fe80::2
+  sessions:
+    - ipv6
+'''
+
+class TestChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        merge_base.cache_clear()
+        base_peers.cache_clear()
+
+        self.git('init', '-q', '-b', 'main')
+        os.mkdir('routers')
+        self.write('routers/router.lon1.yml', f'---\n{PEER_A}\n{PEER_B}')
+        self.write('routers/router.fra1.yml', f'---\n{PEER_A}')
+        self.git('add', '.')
+        self.git('-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '-q', '-m', 'base')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def git(self, *args):
+        subprocess.run(['git', *args], check=True)
+
+    def write(self, filename, content):
+        with open(filename, 'w') as fd:
+            fd.write(content)
+
+    def test_no_changes(self):
+        self.assertEqual(changed_routers('main'), [])
+
+    def test_changed_peer(self):
+        self.write('routers/router.lon1.yml', f"---\n{PEER_A}\n{PEER_B.replace('fe80::2', 'fe80::3')}")
+
+        self.assertEqual(changed_routers('main'), ['router.lon1.yml'])
+
+        peers = read_yaml('routers/router.lon1.yml')
+        self.assertEqual([p['name'] for p in changed_peers('main', 'routers/router.lon1.yml', peers)], ['PEER-B'])
+
+    def test_new_router(self):
+        self.write('routers/router.ams1.yml', f'---\n{PEER_B}')
+        self.git('add', '.')
+
+        peers = read_yaml('routers/router.ams1.yml')
+        self.assertEqual(changed_routers('main'), ['router.ams1.yml'])
+        self.assertEqual([p['name'] for p in changed_peers('main', 'routers/router.ams1.yml', peers)], ['PEER-B'])
+
+    def test_validation_changed(self):
+        self.write('validate_config.py', '')
+        self.git('add', '.')
+        self.assertIsNone(changed_routers('main'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import ipaddress
+import os
+import pickle
+import unittest
+import yaml
+
+from model import Peer, WireguardEndpoint, load_peers
+from peerfile import PeersDumper, safe_load
+from tests.routers import copy_routers, read_router
+
+ROUTER = read_router('router.lon1.yml')
+
+
+class TestModel(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(copy_routers(self, 'router.lon1.yml'), 'router.lon1.yml')
+
+    def test_load_peers(self):
+        peer_a, peer_b = load_peers(self.filename)
+
+        self.assertEqual((peer_a.filename, peer_a.line, peer_b.line), (self.filename, 2, 16))
+        self.assertEqual(peer_a.ipv4, ipaddress.ip_interface('172.20.0.1/30'))
+        self.assertEqual(peer_a.address('ipv6'), 'fe80::207')
+        self.assertIsNone(peer_a.local_ipv4)
+        self.assertEqual(peer_a.local_ipv6, ipaddress.ip_interface('fd00::1/64'))
+        self.assertEqual(peer_a.wireguard.hostname, 'peer-a.example.com')
+
+        # addresses that do not parse are None, and kept as written
+        self.assertIsNone(peer_b.ipv4)
+        self.assertEqual(peer_b.address('ipv4'), 'not an address')
+        self.assertEqual(peer_b.wireguard.ip, ipaddress.ip_address('2001:db8::1'))
+        self.assertIsNone(peer_b.wireguard.hostname)
+
+        # reads like the mapping it came from, without __line__
+        self.assertEqual(peer_a['asn'], 4242420207)
+        self.assertNotIn('__line__', peer_a)
+        self.assertNotIn('__line__', peer_a['wireguard'])
+        self.assertEqual((peer_b.get('sessions'), peer_b.get('local_ipv4')), ('ipv4', None))
+
+    def test_round_trip(self):
+        peers = list(load_peers(self.filename))
+        self.assertEqual([peer.to_dict() for peer in peers], safe_load(ROUTER))
+
+        dumped = yaml.dump(peers, Dumper=PeersDumper, sort_keys=False, explicit_start=True)
+        self.assertEqual(safe_load(dumped), safe_load(ROUTER))
+        self.assertEqual(dumped, yaml.dump(safe_load(ROUTER), Dumper=PeersDumper, sort_keys=False, explicit_start=True))
+
+    def test_pickle(self):
+        peer = next(load_peers(self.filename))
+        copy = pickle.loads(pickle.dumps(peer))
+        self.assertEqual(copy, peer)
+        self.assertEqual((copy.line, copy.ipv4, copy.wireguard.hostname), (2, peer.ipv4, 'peer-a.example.com'))
+
+    def test_of(self):
+        peer = Peer({'name': 'PEER-A', 'wireguard': 'not a mapping'})
+        self.assertIs(Peer.of(peer), peer)
+        self.assertIsNone(peer.wireguard)
+        self.assertEqual(Peer.of({'name': 'PEER-A', '__line__': 3}).line, 3)
+        self.assertIsInstance(Peer({'wireguard': {}}).wireguard, WireguardEndpoint)
+
+
+if __name__ == '__main__':
+    unittest.main()
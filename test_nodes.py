@@ -0,0 +1,53 @@
+import json
+import os
+import tempfile
+import unittest
+
+from requests import ConnectionError
+from unittest import mock
+
+from nodes import NodeCatalog
+
+NODES = [
+    {'hostname': 'router.lon1', 'type': 'dual-stack', 'name': 'lon1', 'city': 'London'},
+    {'hostname': 'router.sin1', 'type': 'ipv4', 'name': 'sin1', 'city': 'Singapore'},
+]
+
+
+class TestNodeCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.snapshot = os.path.join(self.tmp.name, 'nodes.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_nodes_snapshot(self):
+        with mock.patch.object(NodeCatalog, '_fetch', return_value=NODES) as fetch:
+            self.assertEqual(NodeCatalog(snapshot=self.snapshot).nodes(), NODES)
+            self.assertEqual(fetch.call_count, 1)
+
+            # fresh snapshot is used without fetching
+            catalog = NodeCatalog(snapshot=self.snapshot)
+            self.assertEqual(catalog.node_types(), {'router.lon1': 'dual-stack', 'router.sin1': 'ipv4'})
+            self.assertEqual(fetch.call_count, 1)
+
+            # stale snapshot is fetched again
+            NodeCatalog(snapshot=self.snapshot, max_age=0).nodes()
+            self.assertEqual(fetch.call_count, 2)
+
+    def test_nodes_offline(self):
+        with open(self.snapshot, 'w') as fd:
+            json.dump({'fetched': 0, 'nodes': NODES}, fd)
+
+        # API unreachable, snapshot used regardless of age
+        with mock.patch.object(NodeCatalog, '_fetch', side_effect=ConnectionError()):
+            self.assertEqual(NodeCatalog(snapshot=self.snapshot).nodes(), NODES)
+
+            os.remove(self.snapshot)
+            with self.assertRaises(ConnectionError):
+                NodeCatalog(snapshot=self.snapshot).nodes()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+import yaml
+
+from peerfile import PeerFile, SafeLineLoader, iter_peers
+
+ROUTER = """---
+# peers of router.lon1
+- name: PEER-A
+  asn: 4242420207
+
+# moved from router.ams1
+- name: PEER-C
+  asn: 4242420209
+  sessions: [ipv6]
+
+- name: PEER-E
+  asn: 4242420211
+"""
+
+
+class TestPeerfile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'router.yml')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, content):
+        with open(self.filename, 'w') as fd:
+            fd.write(content)
+
+    def test_iter_peers(self):
+        self.write("---\n- name: PEER-A\n  sessions:\n    - ipv6\n  wireguard:\n    public_key: a\n\n- name: PEER-B\n")
+
+        with open(self.filename, 'r') as fd:
+            self.assertEqual(list(iter_peers(self.filename)), yaml.load(fd, Loader=SafeLineLoader))
+        self.assertEqual(list(iter_peers(self.filename, lines=False)), [
+            {'name': 'PEER-A', 'sessions': ['ipv6'], 'wireguard': {'public_key': 'a'}}, {'name': 'PEER-B'}
+        ])
+
+    def test_iter_peers_empty(self):
+        for content in ['', '---\n', '---\n[]\n']:
+            self.write(content)
+            self.assertEqual(list(iter_peers(self.filename)), [])
+
+    def read(self):
+        with open(self.filename, 'r') as fd:
+            return fd.read()
+
+    def test_peer_file_remove(self):
+        self.write(ROUTER)
+        router_file = PeerFile(self.filename)
+        self.assertEqual(len(router_file), 3)
+        self.assertFalse(router_file.save())
+
+        router_file.remove(1)
+        self.assertTrue(router_file.save())
+        self.assertEqual(self.read(), ROUTER.replace(
+            "# moved from router.ams1\n- name: PEER-C\n  asn: 4242420209\n  sessions: [ipv6]\n\n", ""
+        ))
+
+        router_file = PeerFile(self.filename)
+        router_file.remove(1)
+        router_file.save()
+        self.assertEqual(self.read(), "---\n# peers of router.lon1\n- name: PEER-A\n  asn: 4242420207\n")
+
+        router_file = PeerFile(self.filename)
+        router_file.remove(0)
+        router_file.save()
+        self.assertEqual(self.read(), "---\n# peers of router.lon1\n")
+        self.assertEqual(list(iter_peers(self.filename)), [])
+
+    def test_peer_file_insert(self):
+        self.write(ROUTER)
+        router_file = PeerFile(self.filename)
+        router_file.insert({'name': 'PEER-D', 'asn': 4242420210, 'sessions': ['ipv6']})
+        router_file.insert({'name': 'PEER-F', 'asn': 4242420212})
+        router_file.insert({'name': 'PEER-B', 'asn': 4242420208})
+        router_file.replace(0, {'name': 'PEER-A', 'asn': 4242420200})
+        router_file.save()
+
+        self.assertEqual([peer['name'] for peer in iter_peers(self.filename)],
+                         ['PEER-A', 'PEER-B', 'PEER-C', 'PEER-D', 'PEER-E', 'PEER-F'])
+        self.assertIn("\n  sessions: [ipv6]\n\n- name: PEER-D\n  asn: 4242420210\n  sessions:\n    - ipv6\n\n- name: PEER-E", self.read())
+        self.assertTrue(self.read().startswith("---\n# peers of router.lon1\n- name: PEER-A\n  asn: 4242420200\n\n- name: PEER-B\n"))
+
+    def test_peer_file_insert_empty(self):
+        self.write('---\n')
+        router_file = PeerFile(self.filename)
+        router_file.insert({'name': 'PEER-A', 'asn': 4242420207})
+        router_file.save()
+        self.assertEqual(self.read(), "---\n- name: PEER-A\n  asn: 4242420207\n")
+
+    def test_peer_file_flow_style(self):
+        self.write('---\n[{name: PEER-A}]\n')
+        with self.assertRaises(yaml.YAMLError):
+            PeerFile(self.filename)
+
+    def test_iter_peers_invalid(self):
+        for content in ['---\nname: PEER-A\n', '---\n- name: PEER-A\n---\n- name: PEER-B\n', '---\n- name: [\n']:
+            self.write(content)
+            with self.assertRaises(yaml.YAMLError):
+                list(iter_peers(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from unittest import mock
+from prune import add_contacts, format_report_entry, prune_routers, registry
+from resolver import DNS_TIMEOUT_ERROR
+
+
+class TestPrune(unittest.TestCase):
+    def test_prune_routers(self):
+        peers = [{'name': f'PEER-{c}'} for c in 'ABCD']
+        results = iter([
+            (('router.ams1', 0, peers[0]), ['asn must exist'], 'a\n'),
+            (('router.ams1', 1, peers[1]), ['name must exist'], 'b\n'),
+            (('router.ams1', 2, peers[2]), [], 'c\n'),
+            (('router.lon1', 0, peers[3]), [], 'd\n'),
+        ])
+
+        self.assertEqual(list(prune_routers(['router.ams1', 'router.fra1', 'router.lon1'], results)), [
+            # consecutive invalid peers are both removed
+            ('router.ams1', 'a\nb\nc\n', [(0, peers[0], ['asn must exist']), (1, peers[1], ['name must exist'])]),
+            ('router.fra1', '', []),
+            ('router.lon1', 'd\n', []),
+        ])
+
+    def test_prune_retryable(self):
+        # peers failing only on DNS timeouts are kept for the next run
+        peers = [{'name': f'PEER-{c}'} for c in 'AB']
+        results = iter([
+            (('router.ams1', 0, peers[0]), [DNS_TIMEOUT_ERROR], 'a\n'),
+            (('router.ams1', 1, peers[1]), ['asn must exist', DNS_TIMEOUT_ERROR], 'b\n'),
+        ])
+
+        self.assertEqual(list(prune_routers(['router.ams1'], results)), [
+            ('router.ams1', 'a\nb\n', [(1, peers[1], ['asn must exist', DNS_TIMEOUT_ERROR])]),
+        ])
+
+    def test_format_report_entry(self):
+        self.assertEqual(
+            format_report_entry('router.ams1', [{'name': 'PEER-A', 'reasons': ['asn must exist', 'sessions must exist']}]),
+            "### router.ams1\n- PEER-A\n  * asn must exist\n  * sessions must exist\n"
+        )
+
+    def test_add_contacts(self):
+        entries = [{'name': f'PEER-{c}', 'reasons': ['asn is not registered']} for c in 'ABC']
+        peers = [{'name': 'PEER-A', 'asn': 'AS4242420207'}, {'name': 'PEER-B', 'asn': 4242420208}, {'name': 'PEER-C'}]
+        autnums = {
+            '4242420207': {'as-name': 'PEER-A-AS', 'admin-c': 'FOO-DN42'},
+            '4242420208': {'as-name': 'PEER-B-AS', 'admin-c': 'BAR-DN42'},
+        }
+
+        with mock.patch.object(registry, 'asns_detail', return_value=autnums) as asns_detail, \
+                mock.patch.object(registry, 'persons_detail', return_value={'FOO-DN42': {'contact': 'foo@example.com'}}):
+            add_contacts(entries, peers)
+            self.assertEqual(list(asns_detail.call_args.args[0]), ['4242420207', '4242420208'])
+
+        self.assertEqual(format_report_entry('router.ams1', entries), "\n".join([
+            "### router.ams1",
+            "- PEER-A (PEER-A-AS, contact: foo@example.com)",
+            "  * asn is not registered",
+            # no person object, only its handle
+            "- PEER-B (PEER-B-AS, contact: BAR-DN42)",
+            "  * asn is not registered",
+            "- PEER-C",
+            "  * asn is not registered",
+        ]) + "\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests import RequestException
+from urllib3.util import Retry
+
+from registry import ASNIndex, Registry
+
+ASNS = ['AS4242420207', 'AS4242421080']
+ETAG = '"aut-num-1"'
+
+OBJECTS = {
+    f'aut-num/AS{asn}': [['aut-num', f'AS{asn}'], ['as-name', f'AS{asn}-AS'], ['admin-c', 'FOO-DN42']]
+    for asn in range(4242420200, 4242420208)
+}
+OBJECTS['person/FOO-DN42'] = [['person', 'Foo'], ['contact', 'foo@example.com'], ['nic-hdl', 'FOO-DN42']]
+OBJECTS['person/BROKEN-DN42'] = 'not a list of pairs'
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    '''Stand-in for the explorer.dn42.dev registry API'''
+    requests = []
+
+    # seconds to answer an object in, and how often to fail first with a 503
+    delay = 0
+    unavailable = 0
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('If-None-Match')))
+
+        if self.path.endswith('?raw'):
+            return self.send_object(self.path[1:-4])
+
+        if self.path != '/aut-num':
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = json.dumps({'aut-num': ASNS}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_object(self, name):
+        time.sleep(RegistryHandler.delay)
+        if RegistryHandler.unavailable:
+            RegistryHandler.unavailable -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if name not in OBJECTS:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = json.dumps({name: OBJECTS[name]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except BrokenPipeError:
+            # the client timed out already
+            pass
+
+    def log_message(self, *args):
+        pass
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        RegistryHandler.requests = []
+        RegistryHandler.delay = 0
+        RegistryHandler.unavailable = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RegistryHandler)
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.snapshot = os.path.join(self.tmp.name, 'registry.json')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_asns_snapshot(self):
+        # first fetch stores the snapshot
+        self.assertEqual(Registry(base=self.base, snapshot=self.snapshot).asns(), ASNS)
+        self.assertEqual(RegistryHandler.requests, [('/aut-num', None)])
+
+        # fresh snapshot is used without a request
+        self.assertEqual(Registry(base=self.base, snapshot=self.snapshot).asns(), ASNS)
+        self.assertEqual(len(RegistryHandler.requests), 1)
+
+        # stale snapshot is revalidated with a conditional GET
+        self.assertEqual(Registry(base=self.base, snapshot=self.snapshot, max_age=0).asns(), ASNS)
+        self.assertEqual(RegistryHandler.requests[-1], ('/aut-num', ETAG))
+
+    def test_asns_snapshot_malformed(self):
+        # a snapshot of another shape is fetched again
+        for content in ['[]', '{}', '{"aut-num": []}', 'not json']:
+            with open(self.snapshot, 'w') as fd:
+                fd.write(content)
+            self.assertEqual(Registry(base=self.base, snapshot=self.snapshot).asns(), ASNS)
+        self.assertEqual(len(RegistryHandler.requests), 4)
+
+    def test_asns_offline(self):
+        Registry(base=self.base, snapshot=self.snapshot).asns()
+        self.server.shutdown()
+        self.server.server_close()
+
+        # registry unreachable, snapshot used regardless of age
+        self.assertEqual(Registry(base=self.base, snapshot=self.snapshot, max_age=0).asns(), ASNS)
+
+    def test_asn_index(self):
+        registry = Registry(base=self.base, snapshot=self.snapshot)
+        index = registry.asn_index()
+
+        # built once per snapshot
+        self.assertIs(registry.asn_index(), index)
+        self.assertEqual(len(RegistryHandler.requests), 1)
+
+        self.assertIn(4242420207, index)
+        self.assertIn('4242420207', index)
+        self.assertNotIn(4242420208, index)
+        self.assertNotIn('04242420207', index)
+        self.assertNotIn(True, index)
+
+    def test_asn_index_threads(self):
+        registry = Registry(base=self.base, snapshot=self.snapshot)
+        with ThreadPoolExecutor(4) as pool:
+            indexes = list(pool.map(lambda _: registry.asn_index(), range(4)))
+
+        # fetched once, by whichever thread got there first
+        self.assertEqual(len(RegistryHandler.requests), 1)
+        self.assertTrue(all(index is indexes[0] for index in indexes))
+
+    def test_asn_index_range(self):
+        index = ASNIndex(['AS4242420207', 'AS64512', 'AS4242421080', 'AS4242420000', 'AS4242430000', 'AS-SET'])
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.range(4242420000, 4242429999), [4242420000, 4242420207, 4242421080])
+        self.assertEqual(index.range(4242420001, 4242420206), [])
+
+    def test_asns_detail(self):
+        registry = Registry(base=self.base, snapshot=self.snapshot)
+        asns = list(range(4242420200, 4242420208))
+
+        # fetched concurrently
+        RegistryHandler.delay = 0.2
+        start = time.monotonic()
+        details = registry.asns_detail(asns + [4242420299, 4242420200])
+        self.assertLess(time.monotonic() - start, 0.2 * len(asns) / 2)
+
+        # unregistered ASNs are left out
+        self.assertEqual(list(details), asns)
+        self.assertEqual(details[4242420207]['as-name'], 'AS4242420207-AS')
+        self.assertEqual(len(RegistryHandler.requests), len(asns) + 1)
+
+        # answered from the cache
+        self.assertEqual(registry.asn(4242420207), details[4242420207])
+        self.assertEqual(registry.persons_detail(['FOO-DN42', 'BAR-DN42']),
+                         {'FOO-DN42': dict(OBJECTS['person/FOO-DN42'])})
+        self.assertEqual(len(RegistryHandler.requests), len(asns) + 3)
+
+    def test_objects_cache(self):
+        registry = Registry(base=self.base, snapshot=self.snapshot, cache_size=2)
+
+        # callers get their own copy of a cached object
+        registry.person('FOO-DN42')['contact'] = 'changed'
+        self.assertEqual(registry.persons_detail(['FOO-DN42'])['FOO-DN42']['contact'], 'foo@example.com')
+        self.assertEqual(len(RegistryHandler.requests), 1)
+
+        # least recently used objects make way
+        registry.asns_detail([4242420200, 4242420201])
+        registry.person('FOO-DN42')
+        self.assertEqual(len(RegistryHandler.requests), 4)
+
+        # a malformed object is as good as none
+        self.assertEqual(registry.persons_detail(['BROKEN-DN42']), {})
+
+        # nothing keeps the registry alive once it is dropped
+        ref = weakref.ref(registry)
+        del registry
+        self.assertIsNone(ref())
+
+    def test_retries(self):
+        # retried with backoff while the registry is unavailable
+        RegistryHandler.unavailable = 2
+        registry = Registry(base=self.base, snapshot=self.snapshot, retries=Retry(
+            total=2, backoff_factor=0.01, status_forcelist=[503], raise_on_status=False))
+        self.assertEqual(registry.person('FOO-DN42')['contact'], 'foo@example.com')
+        self.assertEqual(len(RegistryHandler.requests), 3)
+
+        # until it gives up
+        RegistryHandler.unavailable = 3
+        with self.assertRaises(RequestException):
+            registry.asn(4242420207)
+
+        # slow answers time out
+        RegistryHandler.delay = 0.5
+        registry = Registry(base=self.base, snapshot=self.snapshot, timeout=0.1, retries=0)
+        with self.assertRaises(RequestException):
+            registry.asns_detail([4242420207])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+from resolver import Resolver, endpoint_hostnames, is_timeout
+
+RECORDS = {
+    ('dual.example', 'AAAA'): ['2001:db8::1'],
+    ('dual.example', 'A'): ['192.0.2.1'],
+    ('v4.example', 'A'): ['192.0.2.2'],
+}
+
+def fake_resolve(hostname, rdtype, **kwargs):
+    if (hostname, rdtype) not in RECORDS:
+        raise dns.resolver.NoAnswer()
+    return Answer(SimpleNamespace(address=address) for address in RECORDS[(hostname, rdtype)])
+
+class Answer(list):
+    rrset = SimpleNamespace(ttl=3600)
+
+class StubServer(object):
+    '''
+    A DNS server on localhost answering from RECORDS, and never
+    answering for the silent hostnames
+    '''
+    def __init__(self, silent=()):
+        self.silent = silent
+        self.queries = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                wire, address = self.sock.recvfrom(65535)
+            except OSError:
+                return
+
+            query = dns.message.from_wire(wire)
+            question = query.question[0]
+            key = (question.name.to_text(omit_final_dot=True), dns.rdatatype.to_text(question.rdtype))
+            self.queries.append(key)
+            if key[0] in self.silent:
+                continue
+
+            response = dns.message.make_response(query)
+            if key in RECORDS:
+                response.answer.append(dns.rrset.from_text_list(question.name, 60, 'IN', key[1], RECORDS[key]))
+            else:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            self.sock.sendto(response.to_wire(), address)
+
+    def resolver(self):
+        stub = dns.resolver.Resolver(configure=False)
+        stub.nameservers = ['127.0.0.1']
+        stub.port = self.sock.getsockname()[1]
+        return stub
+
+    def close(self):
+        self.sock.close()
+
+class TestResolver(unittest.TestCase):
+
+    def test_endpoint_hostnames(self):
+        peers = [
+            {'wireguard': {'remote_address': 'dual.example'}},
+            {'wireguard': {'remote_address': '192.0.2.1'}},
+            {'wireguard': {'remote_address': '2001:db8::1'}},
+            {'wireguard': {'public_key': 'abc'}},
+            {'wireguard': []},
+            {'name': 'NO-WIREGUARD'},
+            {'wireguard': {'remote_address': 'dual.example'}},
+        ]
+        self.assertEqual(endpoint_hostnames(peers), {'dual.example'})
+
+    def test_prefetch(self):
+        resolver = Resolver()
+        with mock.patch('dns.resolver.resolve', side_effect=fake_resolve) as resolve:
+            resolver.prefetch(['dual.example', 'v4.example'])
+            self.assertEqual(resolve.call_count, 4)
+
+            self.assertEqual(resolver.resolve('dual.example', 'AAAA'), ['2001:db8::1'])
+            self.assertEqual(resolver.resolve('v4.example', 'A'), ['192.0.2.2'])
+            with self.assertRaises(dns.resolver.NoAnswer):
+                resolver.resolve('v4.example', 'AAAA')
+
+            # answered from prefetched results
+            self.assertEqual(resolve.call_count, 4)
+
+            # not prefetched; resolved on demand
+            with self.assertRaises(dns.resolver.NoAnswer):
+                resolver.resolve('other.example', 'A')
+            self.assertEqual(resolve.call_count, 5)
+
+    def test_answer_key(self):
+        resolver = Resolver()
+        with mock.patch('dns.resolver.resolve', side_effect=fake_resolve):
+            self.assertEqual(resolver.answer_key('dual.example'), [['AAAA', ['2001:db8::1']], ['A', ['192.0.2.1']]])
+            self.assertEqual(resolver.answer_key('v4.example'), [['AAAA', 'NoAnswer'], ['A', ['192.0.2.2']]])
+
+        # transient failures are not answers to key anything on
+        with mock.patch('dns.resolver.resolve', side_effect=dns.resolver.LifetimeTimeout(timeout=5.0, errors={})):
+            self.assertIsNone(resolver.answer_key('other.example'))
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_file = os.path.join(tmp, 'dns.json')
+
+            resolver = Resolver()
+            resolver.load_cache(cache_file)
+            with mock.patch('dns.resolver.resolve', side_effect=fake_resolve):
+                resolver.prefetch(['dual.example', 'v4.example'])
+            resolver.save_cache()
+
+            # answered from disk, including the negative answer
+            resolver = Resolver()
+            resolver.load_cache(cache_file)
+            with mock.patch('dns.resolver.resolve', side_effect=fake_resolve) as resolve:
+                resolver.prefetch(['dual.example', 'v4.example'])
+                self.assertEqual(resolve.call_count, 0)
+                self.assertEqual(resolver.resolve('dual.example', 'A'), ['192.0.2.1'])
+                with self.assertRaises(dns.resolver.NoAnswer):
+                    resolver.resolve('v4.example', 'AAAA')
+
+            # max_age shorter than the age of the entries
+            resolver = Resolver()
+            with mock.patch('time.time', return_value=time.time() + 60):
+                resolver.load_cache(cache_file, max_age=30)
+            with mock.patch('dns.resolver.resolve', side_effect=fake_resolve) as resolve:
+                resolver.prefetch(['dual.example'])
+                self.assertEqual(resolve.call_count, 2)
+
+            # refresh ignores the cache
+            resolver = Resolver()
+            resolver.load_cache(cache_file, refresh=True)
+            with mock.patch('dns.resolver.resolve', side_effect=fake_resolve) as resolve:
+                resolver.prefetch(['dual.example', 'v4.example'])
+                self.assertEqual(resolve.call_count, 4)
+
+    def test_stub(self):
+        server = StubServer()
+        self.addCleanup(server.close)
+
+        resolver = Resolver(stub=server.resolver())
+        resolver.prefetch(['dual.example', 'v4.example'])
+        self.assertEqual(sorted(server.queries), [
+            ('dual.example', 'A'), ('dual.example', 'AAAA'), ('v4.example', 'A'), ('v4.example', 'AAAA'),
+        ])
+        self.assertEqual(resolver.resolve('dual.example', 'AAAA'), ['2001:db8::1'])
+        self.assertEqual(resolver.answer_key('v4.example'), [['AAAA', 'NXDOMAIN'], ['A', ['192.0.2.2']]])
+
+    def test_timeout(self):
+        server = StubServer(silent={'slow.example'})
+        self.addCleanup(server.close)
+
+        # A and AAAA time out together, not one after the other
+        resolver = Resolver(timeout=0.5, stub=server.resolver())
+        start = time.monotonic()
+        resolver.prefetch(['slow.example'])
+        self.assertLess(time.monotonic() - start, 0.9)
+
+        with self.assertRaises(dns.exception.Timeout):
+            resolver.resolve('slow.example', 'AAAA')
+        self.assertIsNone(resolver.answer_key('slow.example'))
+
+        # still a timeout when handed to another process; other errors are not
+        answers = resolver.answers(['slow.example', 'v4.example'])
+        self.assertTrue(is_timeout(answers[('slow.example', 'A')]))
+        self.assertFalse(is_timeout(answers[('v4.example', 'AAAA')]))
+        self.assertIsInstance(answers[('v4.example', 'AAAA')], dns.exception.DNSException)
+
+    def test_retry(self):
+        server = StubServer(silent={'dual.example'})
+        self.addCleanup(server.close)
+
+        resolver = Resolver(timeout=0.3, stub=server.resolver())
+        with self.assertRaises(dns.exception.Timeout):
+            resolver.resolve('dual.example', 'A')
+
+        # the timeout is kept for the run, until retried
+        server.silent = set()
+        resolver.submit(['dual.example'])
+        with self.assertRaises(dns.exception.Timeout):
+            resolver.resolve('dual.example', 'A')
+
+        resolver.submit(['dual.example'], retry=True)
+        self.assertEqual(resolver.resolve('dual.example', 'A'), ['192.0.2.1'])
+        self.assertEqual(resolver.answer_key('dual.example'), [['AAAA', ['2001:db8::1']], ['A', ['192.0.2.1']]])
+
+        # answers that did not time out are not looked up again
+        queries = len(server.queries)
+        resolver.submit(['dual.example'], retry=True)
+        resolver.prefetch(['dual.example'])
+        self.assertEqual(len(server.queries), queries)
+
+    def test_budget(self):
+        server = StubServer(silent={'slow.example'})
+        self.addCleanup(server.close)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_file = os.path.join(tmp, 'dns.json')
+            resolver = Resolver(timeout=5.0, budget=0.3, stub=server.resolver())
+            resolver.load_cache(cache_file)
+
+            start = time.monotonic()
+            resolver.prefetch(['slow.example'])
+            self.assertLess(time.monotonic() - start, 1.0)
+
+            # once the budget is spent nothing is looked up any more
+            queries = len(server.queries)
+            with self.assertRaises(dns.exception.Timeout):
+                resolver.resolve('dual.example', 'A')
+            self.assertEqual(len(server.queries), queries)
+
+            # nor are timeouts kept on disk
+            resolver.save_cache()
+            with open(cache_file) as fd:
+                self.assertEqual(fd.read(), '{}')
+
+if __name__ == '__main__':
+    unittest.main()
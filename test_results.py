@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from results import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+    def test_key(self):
+        peer = {'name': 'PEER-A', 'sessions': ['ipv6']}
+        self.assertEqual(ResultCache.key('ipv4', peer), ResultCache.key('ipv4', dict(reversed(peer.items()))))
+        self.assertNotEqual(ResultCache.key('ipv4', peer), ResultCache.key('dual-stack', peer))
+        self.assertNotEqual(ResultCache.key('ipv4', peer), ResultCache.key('ipv4', {**peer, 'sessions': ['ipv4']}))
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'results.json')
+
+            results = ResultCache()
+            results.load(filename)
+            self.assertIsNone(results.get('a'))
+            results.put('a', ['asn must exist'], 'Validating peer: PEER-A... FAIL\n')
+            results.put('b', [], 'Validating peer: PEER-B... ok\n')
+            results.save()
+
+            results = ResultCache()
+            results.load(filename)
+            self.assertEqual(results.get('a'), (['asn must exist'], 'Validating peer: PEER-A... FAIL\n'))
+
+            results = ResultCache()
+            results.load(filename, refresh=True)
+            self.assertIsNone(results.get('a'))
+
+            # entries unused for max_age are dropped
+            with open(filename, 'r') as fd:
+                entries = json.load(fd)
+            entries['a']['used'] = time.time() - ResultCache.MAX_AGE - 1
+            with open(filename, 'w') as fd:
+                json.dump(entries, fd)
+
+            results = ResultCache()
+            results.load(filename)
+            self.assertIsNone(results.get('a'))
+            self.assertEqual(results.get('b'), ([], 'Validating peer: PEER-B... ok\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
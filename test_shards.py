@@ -0,0 +1,81 @@
+import argparse
+import io
+import os
+import tempfile
+import unittest
+
+from contextlib import redirect_stdout
+from resolver import DNS_TIMEOUT_ERROR
+from shards import assign_shards, main, merge_errors, merge_reports, parse_shard
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, content):
+        filename = os.path.join(self.tmp.name, name)
+        with open(filename, 'w') as fd:
+            fd.write(content)
+        return filename
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('2/4'), (2, 4))
+        for value in ['0/4', '5/4', '1', 'a/b']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(value)
+
+    def test_assign_shards(self):
+        weights = {'router.a': 10, 'router.b': 7, 'router.c': 5, 'router.d': 4, 'router.e': 2, 'router.f': 2}
+        assignment = assign_shards(weights, 2)
+
+        loads = [0, 0]
+        for name, shard in assignment.items():
+            loads[shard] += weights[name]
+        self.assertEqual(loads, [16, 14])
+
+        # the same on every runner, whatever order the weights are in
+        self.assertEqual(assign_shards(dict(reversed(weights.items())), 2), assignment)
+        self.assertEqual(set(assign_shards(weights, 8).values()), set(range(6)))
+
+    def test_merge_errors(self):
+        files = [
+            self.write('errors-1.txt', 'routers/router.lon1.yml:2 asn must exist\nrouters/router.lon1.yml:1 name must exist\n'),
+            self.write('errors-2.txt', 'routers/router.ams1.yml:9 sessions must exist\n'),
+            self.write('errors-3.txt', ''),
+        ]
+        self.assertEqual(merge_errors(files), [
+            'routers/router.ams1.yml:9 sessions must exist',
+            'routers/router.lon1.yml:2 asn must exist',
+            'routers/router.lon1.yml:1 name must exist',
+        ])
+
+    def test_merge_errors_status(self):
+        timeouts = [
+            self.write('errors-1.txt', f'routers/router.lon1.yml:2 {DNS_TIMEOUT_ERROR}\n'),
+            self.write('errors-2.txt', f'routers/router.ams1.yml:9 {DNS_TIMEOUT_ERROR}\n'),
+        ]
+        failures = [timeouts[0], self.write('errors-3.txt', 'routers/router.ams1.yml:9 sessions must exist\n')]
+
+        # only DNS timeouts across the shards: retryable, as from validate_config.py
+        for files, status in [(timeouts, 3), (failures, 2), ([self.write('errors-4.txt', '')], 0)]:
+            with self.assertRaises(SystemExit) as exit, redirect_stdout(io.StringIO()):
+                main(argparse.Namespace(command='errors', files=files))
+            self.assertEqual(exit.exception.code, status)
+
+    def test_merge_reports(self):
+        files = [
+            self.write('report-1.txt', '### router.lon1\n- PEER-B\n  * asn must exist\n\n'),
+            self.write('report-2.txt', 'No changes.\n'),
+            self.write('report-3.txt', '### router.ams1\n- PEER-A\n  * name must exist\n\n'),
+        ]
+        self.assertEqual(merge_reports(files),
+                         '### router.ams1\n- PEER-A\n  * name must exist\n\n### router.lon1\n- PEER-B\n  * asn must exist\n\n')
+        self.assertEqual(merge_reports(files[1:2]), 'No changes.\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from snapshot import Snapshot, compile_snapshot, load_snapshot
+from tests.routers import copy_routers, read_router
+
+FRA1 = read_router('router.fra1.yml')
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.routers = copy_routers(self)
+        self.snapshot = os.path.join(os.path.dirname(self.routers), 'peers.snapshot')
+
+    def write(self, name, content):
+        with open(os.path.join(self.routers, name), 'w') as fd:
+            fd.write(content)
+
+    def test_peers(self):
+        snapshot = load_snapshot(self.snapshot, self.routers)
+
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(snapshot.routers, ['router.fra1', 'router.lon1'])
+        self.assertEqual(list(snapshot.peers('router.lon1')), [
+            ('router.lon1', {
+                '__line__': 2, 'name': 'PEER-A', 'asn': 4242420207,
+                'ipv4': '172.20.0.1/30', 'ipv6': 'fe80::207', 'local_ipv6': 'fd00::1/64',
+                'sessions': ['ipv6'], 'multiprotocol': True, 'extended_nexthop': True,
+                'wireguard': {
+                    'remote_address': 'peer-a.example.com', 'remote_port': 20207,
+                    'public_key': 'vLfdP6SrkTfOnn/iYPM/ytMIU/vseZVNoAdgNbo1yV4=',
+                },
+            }),
+            # values that do not parse are left out
+            ('router.lon1', {'__line__': 16, 'name': 'PEER-B', 'asn': 4242420208,
+                             'wireguard': {'remote_address': '2001:db8::1', 'remote_port': 20208}}),
+        ])
+        self.assertEqual([(router, peer['name']) for router, peer in snapshot.asn_peers('AS4242420207')],
+                         [('router.fra1', 'PEER-A'), ('router.lon1', 'PEER-A')])
+        self.assertEqual(list(snapshot.peers('router.ams1')), [])
+
+    def test_load_snapshot(self):
+        load_snapshot(self.snapshot, self.routers)
+        mtime = os.stat(self.snapshot).st_mtime_ns
+
+        # unchanged router files reuse the snapshot
+        load_snapshot(self.snapshot, self.routers)
+        self.assertEqual(os.stat(self.snapshot).st_mtime_ns, mtime)
+
+        # a changed, broken or new router file compiles it again
+        self.write('router.fra1.yml', FRA1.replace('20208', '20209'))
+        self.write('router.ams1.yml', '- name: [')
+        snapshot = load_snapshot(self.snapshot, self.routers)
+        self.assertEqual(snapshot.routers, ['router.ams1', 'router.fra1', 'router.lon1'])
+        self.assertEqual(list(snapshot.peers('router.ams1')), [])
+        self.assertEqual(next(snapshot.peers('router.fra1'))[1]['wireguard']['remote_port'], 20209)
+
+    def test_empty(self):
+        os.remove(os.path.join(self.routers, 'router.fra1.yml'))
+        self.write('router.lon1.yml', '---\n')
+        compile_snapshot(self.snapshot, self.routers)
+
+        snapshot = Snapshot(self.snapshot)
+        self.assertEqual(len(snapshot), 0)
+        self.assertEqual(list(snapshot.peers()), [])
+
+        with open(self.snapshot, 'wb') as fd:
+            fd.write(b'not a snapshot')
+        with self.assertRaises(ValueError):
+            Snapshot(self.snapshot)
+        self.assertEqual(load_snapshot(self.snapshot, self.routers).routers, ['router.lon1'])
+
+    def test_concurrent_compile(self):
+        # every run compiles through a temporary file of its own
+        with ThreadPoolExecutor(8) as pool:
+            snapshots = list(pool.map(lambda _: load_snapshot(self.snapshot, self.routers), range(8)))
+        self.assertEqual({tuple(snapshot.routers) for snapshot in snapshots}, {('router.fra1', 'router.lon1')})
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.routers))), ['peers.snapshot', 'routers'])
+
+        # and reads what it compiled, whatever happens to the file after
+        self.write('router.fra1.yml', FRA1.replace('20208', '20209'))
+        snapshot = load_snapshot(self.snapshot, self.routers)
+        os.remove(self.snapshot)
+        self.assertEqual(next(snapshot.peers('router.fra1'))[1]['wireguard']['remote_port'], 20209)
+
+
+if __name__ == '__main__':
+    unittest.main()
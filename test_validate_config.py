@@ -1,17 +1,23 @@
+import dns.resolver
 import os
 import unittest
+import validate_config
 
-from validate_config import read_yaml, \
+from peer_index import GlobalIndex, PrefixIndex
+from resolver import Resolver
+from unittest import mock
+from validate_config import DNS_TIMEOUT_ERROR, RULES, read_yaml, report_errors, result_key, \
+        local_rules, network_rules, rules_reading, run_rules, \
         validate,  validate_unique_peers, \
         validate_asn, validate_boolean, \
         validate_name, validate_ip, \
-        validate_sessions, validate_wireguard
+        validate_endpoint, validate_sessions, validate_wireguard
 
 class TestValidateConfig(unittest.TestCase):
 
     def test_validate(self):
         # load all fixture files, test each
-        for fixture in sorted(os.listdir('tests/fixtures')):
+        for fixture in sorted(f for f in os.listdir('tests/fixtures') if os.path.isfile(f'tests/fixtures/{f}')):
             test_case = read_yaml(f'tests/fixtures/{fixture}')
             node_type = test_case.get('node_type', 'dual-stack')
             self.assertEqual(
@@ -19,6 +25,83 @@ class TestValidateConfig(unittest.TestCase):
                 test_case['errors'],
                 f'test_case::{fixture}')
 
+    def test_tiers(self):
+        # --offline (without node types) and --network-only together report the errors of a full run
+        for fixture in sorted(f for f in os.listdir('tests/fixtures') if os.path.isfile(f'tests/fixtures/{f}')):
+            test_case = read_yaml(f'tests/fixtures/{fixture}')
+            node_type = test_case.get('node_type', 'dual-stack')
+            self.assertEqual(
+                sorted(validate(None, test_case['peer'], rules=local_rules()) + validate(node_type, test_case['peer'], rules=network_rules())),
+                sorted(test_case['errors']),
+                f'test_case::{fixture}')
+
+        peer = {'name': 'PEER-A', 'asn': 4242420207, 'ipv4': '172.20.0.1', 'sessions': ['ipv4'],
+                'wireguard': {'remote_address': '2a01:4f8::1', 'public_key': 'vLfdP6SrkTfOnn/iYPM/ytMIU/vseZVNoAdgNbo1yV4='}}
+        require_ipv4 = "wireguard.remote_address must be an IPv4 address or have a valid DNS A record for an IPv4 only router"
+        with mock.patch('validate_config.validate_asn', return_value=None):
+            errors = validate('ipv4', peer)
+            self.assertEqual(errors, ["wireguard.remote_port: must exist when remote_address defined", require_ipv4])
+            self.assertEqual(sorted(validate(None, peer, rules=local_rules()) + validate('ipv4', peer, rules=network_rules())), sorted(errors))
+
+            # the DNS error stays between the wireguard errors
+            with mock.patch('dns.resolver.resolve', side_effect=dns.resolver.NXDOMAIN()):
+                errors = validate('dual-stack', {**peer, 'wireguard': {'remote_address': 'peer-a.tiers.example'}})
+            self.assertEqual(errors, [
+                "wireguard.remote_port: must exist when remote_address defined",
+                "wireguard.remote_address is not a valid IPv4/IPv6 address or no DNS A/AAAA record found",
+                "wireguard.public_key: must exist",
+            ])
+
+    def test_run_rules(self):
+        # rules run cheapest first, errors stay in declaration order
+        self.assertEqual([r.cost for r in RULES][:2], [0, 1])
+        peer = {'name': 'bad name!', 'asn': 4242420207, 'ipv4': '172.20.0.1', 'sessions': ['ipv4'],
+                'wireguard': {'remote_address': '1.0.2.1', 'remote_port': 20207, 'public_key': 'vLfdP6SrkTfOnn/iYPM/ytMIU/vseZVNoAdgNbo1yV4='}}
+        self.assertEqual(list(run_rules('dual-stack', peer)), [r.name for r in sorted(RULES, key=lambda r: r.cost)])
+
+        # with fail_fast a failing cheap rule skips the registry and DNS rules
+        with mock.patch('validate_config.validate_asn') as validate_asn, \
+                mock.patch('validate_config.validate_endpoint') as validate_endpoint:
+            results = run_rules('dual-stack', {**peer, 'wireguard': {**peer['wireguard'], 'remote_address': 'peer-a.example'}}, fail_fast=True)
+            validate_asn.assert_not_called()
+            validate_endpoint.assert_not_called()
+        self.assertNotIn('check_asn', results)
+        self.assertNotIn('check_endpoint', results)
+        self.assertTrue(results['check_name'])
+        self.assertEqual(validate('dual-stack', peer, fail_fast=True), results['check_name'])
+
+        # only the rules reading a changed field run again
+        self.assertEqual([r.name for r in rules_reading(['wireguard'])], ['check_wireguard', 'check_endpoint', 'check_wireguard_settings'])
+        results = run_rules('dual-stack', peer)
+        results.update(run_rules('dual-stack', {**peer, 'name': 'PEER-A'}, rules_reading(['name'])))
+        self.assertEqual(results['check_name'], [])
+
+    def test_validate_wireguard_unresolved(self):
+        # without DNS only a remote_address that is not even a hostname fails
+        invalid = "wireguard.remote_address is not a valid IPv4/IPv6 address or no DNS A/AAAA record found"
+        self.assertIn(invalid, validate_wireguard({'remote_address': None, 'remote_port': 20207}, resolve=False))
+        self.assertNotIn(invalid, validate_wireguard({'remote_address': 'peer-a.example', 'remote_port': 20207}, resolve=False))
+
+    def test_validate_endpoint_timeout(self):
+        def resolve(hostname, rdtype, **kwargs):
+            if hostname == 'slow.example' or rdtype == 'AAAA':
+                raise dns.resolver.LifetimeTimeout(timeout=5.0, errors={})
+            raise dns.resolver.NXDOMAIN()
+
+        with mock.patch('dns.resolver.resolve', side_effect=resolve):
+            # a timeout is reported as such, not as a missing record
+            self.assertEqual(validate_endpoint('slow.example'), [DNS_TIMEOUT_ERROR])
+            self.assertEqual(validate_endpoint('slow.example', require_ipv4=True), [DNS_TIMEOUT_ERROR])
+            self.assertEqual(validate_endpoint('missing.example', require_ipv4=True),
+                    ["wireguard.remote_address must be an IPv4 address or have a valid DNS A record for an IPv4 only router"])
+
+        with self.assertRaises(SystemExit) as exit:
+            report_errors([f"routers/router.ams1.yml:2 {DNS_TIMEOUT_ERROR}"])
+        self.assertEqual(exit.exception.code, 3)
+        with self.assertRaises(SystemExit) as exit:
+            report_errors([f"routers/router.ams1.yml:2 {DNS_TIMEOUT_ERROR}", "routers/router.ams1.yml:8 asn must exist"])
+        self.assertEqual(exit.exception.code, 2)
+
     def test_validate_unique_peers(self):
         not_unique = [
             {'name': 'peer_a', 'ipv4': '192.0.2.1'},
@@ -31,7 +114,110 @@ class TestValidateConfig(unittest.TestCase):
             {'name': 'peer_b', 'ipv4': '192.0.2.2'}
         ]
         self.assertEqual(list(validate_unique_peers(unique[0], unique)), [])
+
+        # same address written differently
+        not_unique_normalized = [
+            {'name': 'peer_a', 'ipv6': 'fe80::0225:0207'},
+            {'name': 'peer_b', 'ipv6': 'fe80::225:207/64'}
+        ]
+        self.assertEqual(list(validate_unique_peers(not_unique_normalized[0], not_unique_normalized)), ["ipv6 address (fe80::0225:0207) must be unique per router: conflict with peer_b"])
+
+        duplicate_name = [
+            {'name': 'peer_a', 'ipv4': '192.0.2.1'},
+            {'name': 'peer_a', 'ipv4': '192.0.2.1'}
+        ]
+        self.assertEqual(list(validate_unique_peers(duplicate_name[0], duplicate_name)), ["name (peer_a) must be unique per router"])
+
+        duplicate_endpoint = [
+            {'name': 'peer_a', 'wireguard': {'remote_address': 'Peer.Example.com', 'remote_port': 20207}},
+            {'name': 'peer_b', 'wireguard': {'remote_address': 'peer.example.com.', 'remote_port': 20207}},
+            {'name': 'peer_c', 'wireguard': {'remote_address': 'peer.example.com', 'remote_port': 20208}}
+        ]
+        self.assertEqual(list(validate_unique_peers(duplicate_endpoint[0], duplicate_endpoint)), ["wireguard endpoint (Peer.Example.com:20207) must be unique per router: conflict with peer_b"])
         
+    def test_prefix_index(self):
+        peers = [
+            {'name': 'peer_a', 'ipv4': '172.20.0.1/30', 'local_ipv4': '172.20.0.2/30', 'ipv6': 'fe80::1/64', 'local_ipv6': 'fe80::100/64'},
+            {'name': 'peer_b', 'ipv4': '172.20.0.3', 'ipv6': 'fe80::2/64', 'local_ipv6': 'fe80::100/64'},
+            {'name': 'peer_c', 'ipv4': '172.20.0.5', 'ipv6': 'fd00::1/64', 'local_ipv4': '172.20.0.2/30'},
+            {'name': 'peer_d', 'ipv6': 'fd00::2/128'},
+        ]
+        prefixes = PrefixIndex(peers)
+
+        self.assertEqual(prefixes.conflicts(0), [
+            "ipv4 network (172.20.0.1/30) overlaps ipv4 (172.20.0.3) of peer_b",
+            "local_ipv4 network (172.20.0.2/30) overlaps ipv4 (172.20.0.3) of peer_b",
+            "ipv4 network (172.20.0.1/30) overlaps local_ipv4 (172.20.0.2/30) of peer_c",
+        ])
+        self.assertEqual(prefixes.conflicts(3), ["ipv6 network (fd00::2/128) overlaps ipv6 (fd00::1/64) of peer_c"])
+
+        self.assertEqual(prefixes.covering('172.20.0.3'), [
+            ('peer_a', 'ipv4', '172.20.0.1/30'), ('peer_a', 'local_ipv4', '172.20.0.2/30'),
+            ('peer_b', 'ipv4', '172.20.0.3'), ('peer_c', 'local_ipv4', '172.20.0.2/30')
+        ])
+        self.assertEqual(prefixes.covering('fe80::100'), [
+            ('peer_a', 'ipv6', 'fe80::1/64'), ('peer_a', 'local_ipv6', 'fe80::100/64'),
+            ('peer_b', 'ipv6', 'fe80::2/64'), ('peer_b', 'local_ipv6', 'fe80::100/64')
+        ])
+        self.assertEqual(prefixes.covering('172.20.1.1'), [])
+
+    def test_prefix_index_shared_networks(self):
+        # peers on one fe80::/64, and our own local addresses shared by all
+        # of them, are never paired up to be checked; only a peer's tunnel
+        # address inside our local network is
+        peers = [{'name': f'peer_{i}', 'ipv4': f'172.20.{i // 256}.{i % 256}', 'ipv6': f'fe80::{i + 2:x}/64',
+                  'local_ipv4': '172.20.53.1/32', 'local_ipv6': 'fe80::1/64'} for i in range(2000)]
+        peers.append({'name': 'peer_z', 'ipv4': '172.20.53.1'})
+        prefixes = PrefixIndex(peers)
+
+        with mock.patch.object(PrefixIndex, '_is_conflict', autospec=True, side_effect=PrefixIndex._is_conflict) as is_conflict:
+            self.assertEqual(prefixes.conflicts(0), ['local_ipv4 network (172.20.53.1/32) overlaps ipv4 (172.20.53.1) of peer_z'])
+        self.assertLess(is_conflict.call_count, 3 * len(peers))
+        self.assertEqual(len(prefixes.conflicts(2000)), 2000)
+        self.assertEqual(len(prefixes.covering('fe80::1')), 4000)
+
+    def test_global_index(self):
+        key_a = 'vLfdP6SrkTfOnn/iYPM/ytMIU/vseZVNoAdgNbo1yV4='
+        key_b = 'wLfdP6SrkTfOnn/iYPM/ytMIU/vseZVNoAdgNbo1yV4='
+        index = GlobalIndex()
+        index.add('router.ams1', {'name': 'PEER-A', 'asn': 4242420207, 'ipv6': 'fd00::1/64', 'wireguard': {'public_key': key_a, 'remote_address': 'Peer.Example.com', 'remote_port': 20207}})
+        index.add('router.ams1', {'name': 'PEER-B', 'asn': 4242420208, 'wireguard': {'public_key': key_b, 'remote_address': '192.0.2.1', 'remote_port': 20207}})
+        index.add('router.fra1', {'name': 'PEER-A', 'asn': 4242420207, 'wireguard': {'public_key': key_a, 'remote_address': '1.0.2.1', 'remote_port': 20207}})
+        index.add('router.fra1', {'name': 'PEER-C', 'asn': 4242420209, 'wireguard': {'public_key': key_b, 'remote_address': 'peer.example.com.', 'remote_port': 20207}})
+
+        self.assertEqual([(e.router, e.position) for e in index.lookup('asn', 'AS4242420207')], [('router.ams1', 0), ('router.fra1', 0)])
+        self.assertEqual([e.name for e in index.lookup('endpoint', 'peer.example.com:20207')], ['PEER-A', 'PEER-C'])
+        self.assertEqual([e.name for e in index.lookup('address', 'fd00:0::1')], ['PEER-A'])
+        self.assertEqual(index.lookup('name', 'PEER-D'), [])
+
+        # a network reusing its key is fine, another network using it is not
+        self.assertEqual(index.conflicts('router.fra1', 0), [])
+        self.assertEqual(index.conflicts('router.ams1', 1), ["wireguard public_key is also used by PEER-C (AS4242420209) on router.fra1"])
+        self.assertEqual(index.conflicts('router.fra1', 1), [
+            "wireguard endpoint (peer.example.com:20207) is also used by PEER-A on router.ams1",
+            "wireguard public_key is also used by PEER-B (AS4242420208) on router.ams1",
+        ])
+
+    def test_result_key(self):
+        peer = {'name': 'PEER-A', 'asn': 4242420207, 'wireguard': {'remote_address': 'peer-a.example', 'remote_port': 20207}}
+        with mock.patch.object(validate_config, 'resolver', Resolver()) as resolver:
+            resolver.add_answers({('peer-a.example', 'AAAA'): ['2001:db8::1'], ('peer-a.example', 'A'): ['192.0.2.1']})
+            key = result_key('dual-stack', peer)
+
+            self.assertEqual(result_key('dual-stack', {**peer, '__line__': 10}), key)
+            self.assertNotEqual(result_key('ipv4', peer), key)
+            self.assertNotEqual(result_key('dual-stack', {**peer, 'asn': 424241000}), key)
+
+            resolver.add_answers({('peer-a.example', 'AAAA'): ['2001:db8::2']})
+            self.assertNotEqual(result_key('dual-stack', peer), key)
+
+            # fail_fast results of a peer failing a cheap rule do not depend on DNS
+            self.assertNotEqual(result_key('dual-stack', peer, fail_fast=True), result_key('dual-stack', peer))
+            bad_name = {**peer, 'name': 'bad name!'}
+            key = result_key('dual-stack', bad_name, fail_fast=True)
+            resolver.add_answers({('peer-a.example', 'AAAA'): ['2001:db8::3']})
+            self.assertEqual(result_key('dual-stack', bad_name, fail_fast=True), key)
+
     def test_validate_asn(self):        
         private_asn = 65000
         private_asn_error = validate_asn(private_asn)
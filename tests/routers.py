@@ -0,0 +1,31 @@
+#
+# Sample router files for the tests, from tests/fixtures/routers
+#
+
+import os
+import shutil
+import tempfile
+
+ROUTERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'routers')
+
+
+def read_router(name):
+    '''Contents of a sample router file, e.g. router.lon1.yml'''
+    with open(os.path.join(ROUTERS, name), 'r') as fd:
+        return fd.read()
+
+
+def copy_routers(test, *names):
+    '''
+    Copy sample router files (all of them by default) into a routers/
+    directory of a temporary directory, removed when test finishes,
+    returning the path of routers/
+    '''
+    tmp = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp.cleanup)
+
+    routers = os.path.join(tmp.name, 'routers')
+    os.mkdir(routers)
+    for name in names or sorted(os.listdir(ROUTERS)):
+        shutil.copy(os.path.join(ROUTERS, name), routers)
+    return routers
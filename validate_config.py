@@ -1,77 +1,454 @@
 #!/usr/bin/env python3
 
 import argparse
-import dns.resolver
+import dns.exception
 import github_action_utils as github
+import hashlib
+import io
 import ipaddress
+import json
 import logging
+import multiprocessing
 import os
 import re
+import time
 import yaml
 
-from yaml.loader import SafeLoader
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from changes import changed_routers, is_changed_peer
+from itertools import islice
+from model import Peer, WireguardEndpoint, load_peers, parse_interface
+from peer_index import GlobalIndex, PrefixIndex, RouterIndex
+from peerfile import SafeLineLoader, strip_lines
+from nodes import NodeCatalog
 from registry import Registry
-from routedbits import RoutedBits
+from resolver import DNS_TIMEOUT_ERROR, Resolver, endpoint_hostnames, is_retryable, is_timeout
+from results import ResultCache
+from shards import parse_shard, shard_routers
+from snapshot import load_snapshot
 
+valid_asns = None
+catalog = NodeCatalog()
+registry = Registry()
+resolver = Resolver()
+result_cache = ResultCache()
 
-class SafeLineLoader(SafeLoader):
-    def construct_mapping(self, node, deep=False):
-        mapping = super(SafeLineLoader, self).construct_mapping(node, deep=deep)
-        # Add 1 so line numbering starts at 1
-        mapping["__line__"] = node.start_mark.line + 1
-        return mapping
+# Results are only reused for the exact validation code they came from,
+# including the modules the rules use and the pinned dependencies
+VERSION_SOURCES = ["validate_config.py", "model.py", "peerfile.py", "resolver.py", "registry.py", "requirements.txt"]
+
+_version = hashlib.sha256()
+for source in VERSION_SOURCES:
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), source), "rb") as fd:
+        _version.update(hashlib.sha256(fd.read()).digest())
+VERSION = _version.hexdigest()
+
+# Peers per unit of work when validating with --jobs
+CHUNK_SIZE = 25
+
+class Timeline(object):
+    """Logs how long after startup each step finished, with --verbose"""
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    def mark(self, step):
+        logging.info(f"{time.perf_counter() - self.start:8.3f}s {step}")
 
-valid_asns = []
 
 def main(args):
     errors = []
-    file_count = 0
 
-    logging.basicConfig(level=logging.FATAL)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.FATAL)
+    timeline = Timeline()
 
-    node_types = { node["hostname"]: node["type"] for node in RoutedBits().nodes(minimal=True) }
+    registry.max_age = args.registry_max_age
+    catalog.max_age = args.nodes_max_age
+    resolver.timeout = args.dns_timeout
+    resolver.budget = args.dns_budget
 
-    nodes = sorted(os.listdir("routers"))
-    if args.router:
-        nodes = [f"{args.router}.yml"]
+    resolver.load_cache(args.dns_cache, max_age=args.dns_max_age, refresh=args.refresh_dns)
+    result_cache.load(args.result_cache, refresh=args.refresh_results)
 
-    for yaml_file in nodes:
-        filename = f"routers/{yaml_file}"
-        router = yaml_file[:-4]
-        peers = read_yaml(filename)
-        file_count += 1
-
-        if peers is not None:
-            logging.info(f"Validating peers in: {filename}")
+    if args.network_only:
+        report_errors(validate_queue(args.queue, args.jobs, timeline), args.errors)
 
-            node_type = node_types[router]
+    def fetch_node_types():
+        node_types = catalog.node_types()
+        timeline.mark(f"node catalog fetched ({len(node_types)} nodes)")
+        return node_types
 
-            for peer in peers:
-                peer_errors = list(validate(node_type, peer))
-                peer_errors += validate_unique_peers(peer, peers)
+    def fetch_asns():
+        asns = registry.asn_index()
+        timeline.mark(f"registry loaded ({len(asns)} ASNs)")
+        return asns
 
-                for e in peer_errors:
-                    post_annotation(e, filename, peer["__line__"])
-                    errors.append(f"{filename}:{peer['__line__']} {e}")
+    if args.offline:
+        # node types are only needed by the network checks
+        node_types = Future()
+        node_types.set_result({})
+    else:
+        # fetch the node catalog and registry while router files are parsed;
+        # each is waited for only where it is first needed
+        startup = ThreadPoolExecutor(2)
+        node_types = startup.submit(fetch_node_types)
+        startup.submit(fetch_asns)
+        startup.shutdown(wait=False)
 
-            # ensure all peers are in alphabetial order
-            peer_names = [peer['name'] for peer in peers]
-            if peer_names != sorted(peer_names):
-                err = "Peers must be in alphabetical order by name"
-                post_annotation(err, filename, 1)
-                errors.append(f"{filename}:1 {err}")
+    nodes = sorted(os.listdir("routers"))
+    if args.router:
+        nodes = [f"{args.router}.yml"]
 
+    # only validate routers changed since a git ref
+    if args.changed_since:
+        changed = changed_routers(args.changed_since)
+        if changed is not None:
+            nodes = [yaml_file for yaml_file in nodes if yaml_file in changed]
         else:
-            logging.debug("No peers found")
+            args.changed_since = None
+
+    # only validate this runner's share of the routers; the snapshot is
+    # read once, for this and for the routers of the other shards below
+    snapshot = None
+    if args.shard:
+        snapshot = load_snapshot()
+        nodes = shard_routers(nodes, args.shard, snapshot)
+
+    routers = []
+    global_index = GlobalIndex()
+    items = read_routers(nodes, node_types, routers, args.changed_since, timeline, global_index)
+
+    # peers validated offline, to queue for the network checks
+    peers = {}
+    queue = []
+    def keep_peers(items):
+        for key, node_type, peer in items:
+            peers[key] = peer
+            yield key, node_type, peer
+
+    peer_errors = {}
+    peer_count = 0
+    for (filename, position), checked_errors, output in validate_stream(
+        keep_peers(items) if args.offline else items,
+        jobs=args.jobs, fail_fast=args.fail_fast, rules=local_rules() if args.offline else RULES
+    ):
+        if not peer_count:
+            timeline.mark("first peer validated")
+        peer_count += 1
+
+        print(output, end="")
+        if checked_errors:
+            peer_errors[(filename, position)] = checked_errors
+
+        if args.offline:
+            peer = peers.pop((filename, position))
+            # with fail_fast, a peer failing a local check gets no network checks
+            if not (args.fail_fast and checked_errors):
+                queue.append({"filename": filename, "line": peer.line, "peer": peer.to_dict()})
+
+    timeline.mark(f"validated {peer_count} peers")
+
+    if args.offline:
+        save_queue(args.queue, {
+            "fail_fast": args.fail_fast,
+            "routers": [filename for filename, _, _, _ in routers],
+            "peers": queue,
+        })
+        timeline.mark(f"queued {len(queue)} peers for network checks")
+
+    resolver.save_cache()
+    result_cache.save()
+
+    # routers not validated here still count for the checks across routers
+    others = {yaml_file[:-4] for yaml_file in os.listdir("routers")} - {yaml_file[:-4] for yaml_file in nodes}
+    if others:
+        if snapshot is None:
+            snapshot = load_snapshot()
+        for router, peer in snapshot.peers():
+            if router in others:
+                global_index.add(router, peer)
+        timeline.mark(f"indexed peers of {len(others)} other routers")
+
+    for filename, lines, index, prefixes in routers:
+        logging.info(f"Validating peers in: {filename}")
+        router = os.path.basename(filename)[:-4]
+
+        # the node catalog is checked with the network checks
+        if not args.offline:
+            errors += check_catalog(filename, node_types.result())
+
+        for position, line in enumerate(lines):
+            for e in peer_errors.get((filename, position), []) + index.conflicts(position) + prefixes.conflicts(position) \
+                    + global_index.conflicts(router, position):
+                post_annotation(e, filename, line)
+                errors.append(f"{filename}:{line} {e}")
+
+        # ensure all peers are in alphabetial order
+        if index.names != sorted(index.names):
+            err = "Peers must be in alphabetical order by name"
+            post_annotation(err, filename, 1)
+            errors.append(f"{filename}:1 {err}")
+
+    report_errors(errors, args.errors)
+
+
+def report_errors(errors, filename=None):
+    """
+    Print errors and exit, with status 2 if there are any, or 3 if they
+    are all DNS timeouts worth retrying
+    """
+    # for merging with the other shards
+    if filename:
+        with open(filename, "w") as fd:
+            fd.writelines(f"{e}\n" for e in errors)
 
     if len(errors):
         for e in errors:
             print(e)
-        exit(2)
+        exit(3 if all(is_retryable(e) for e in errors) else 2)
     else:
         exit(0)
 
 
+def check_catalog(filename, node_types):
+    router = os.path.basename(filename)[:-4]
+    if router in node_types:
+        return []
+
+    err = f"{router} has no entry in the RoutedBits node catalog"
+    post_annotation(err, filename, 1)
+    return [f"{filename}:1 {err}"]
+
+
+def save_queue(filename, queue):
+    """Write the peers queued by --offline for --network-only"""
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(f"{filename}.tmp", "w") as fd:
+        json.dump(queue, fd, indent=2, default=str)
+    os.replace(f"{filename}.tmp", filename)
+
+
+def validate_queue(queue_file, jobs=1, timeline=None):
+    """
+    Run the registry and DNS checks deferred by --offline on every
+    queued peer, returning the errors, and drain the queue. Together
+    with the errors of the --offline run these are the errors of a
+    full run.
+    """
+    try:
+        with open(queue_file, "r") as fd:
+            queue = json.load(fd)
+    except (OSError, ValueError) as e:
+        print(f"No queue of network checks, run with --offline first: {e}")
+        exit(1)
+
+    # every queued endpoint is resolved while the registry is fetched
+    resolver.submit(endpoint_hostnames(p["peer"] for p in queue["peers"]))
+    asns = ThreadPoolExecutor(1)
+    asns.submit(registry.asn_index)
+    asns.shutdown(wait=False)
+
+    node_types = catalog.node_types()
+    if timeline:
+        timeline.mark(f"node catalog fetched ({len(node_types)} nodes)")
+
+    items = (
+        ((p["filename"], p["line"]), node_types.get(os.path.basename(p["filename"])[:-4]),
+         Peer(p["peer"], p["filename"], p["line"]))
+        for p in queue["peers"]
+    )
+
+    peer_errors = defaultdict(list)
+    for (filename, line), checked_errors, output in validate_stream(
+        items, jobs=jobs, fail_fast=queue["fail_fast"], rules=network_rules()
+    ):
+        print(output, end="")
+        for e in checked_errors:
+            post_annotation(e, filename, line)
+            peer_errors[filename].append(f"{filename}:{line} {e}")
+
+    resolver.save_cache()
+    result_cache.save()
+    os.remove(queue_file)
+
+    errors = []
+    for filename in queue["routers"]:
+        errors += check_catalog(filename, node_types)
+        errors += peer_errors[filename]
+    return errors
+
+
+def read_routers(nodes, node_types, routers, changed_since=None, timeline=None, global_index=None):
+    """
+    Stream the peers of every router file, indexing each one for the
+    cross-peer checks and appending (filename, lines, index, prefixes)
+    to routers as files are read, and adding it to global_index if
+    given. Yields ((filename, position), node_type, peer) for the peers
+    to fully validate, with node types from the node_types future.
+    """
+    if timeline:
+        timeline.mark("parsing router files")
+
+    for yaml_file in nodes:
+        filename = f"routers/{yaml_file}"
+        lines, index, prefixes = [], RouterIndex(), PrefixIndex()
+        routers.append((filename, lines, index, prefixes))
+
+        try:
+            for peer in load_peers(filename):
+                position = index.add(peer)
+                prefixes.add(peer)
+                if global_index is not None:
+                    global_index.add(yaml_file[:-4], peer)
+                lines.append(peer.line)
+
+                # peers not to fully validate only get the cross-peer checks
+                if changed_since is None or is_changed_peer(changed_since, filename, peer):
+                    # a router missing from the catalog is reported in main()
+                    yield (filename, position), node_types.result().get(yaml_file[:-4]), peer
+        except yaml.YAMLError as e:
+            print(e)
+            exit(1)
+
+    if timeline:
+        timeline.mark(f"parsed {len(nodes)} router files")
+
+
+def init_worker(asns):
+    global valid_asns, resolver
+    valid_asns = asns
+    # DNS answers are handed over with each chunk
+    resolver = Resolver()
+
+
+def validate_chunk(items, answers=None, fail_fast=False, rules=None):
+    """Validate (node_type, peer) items, returning the errors and progress output of each peer"""
+    if answers:
+        resolver.add_answers(answers)
+
+    results = []
+    for node_type, peer in items:
+        # capture progress output so it can be printed in order
+        with redirect_stdout(io.StringIO()) as output:
+            errors = list(validate(node_type, peer, fail_fast=fail_fast, rules=rules))
+        results.append((errors, output.getvalue()))
+    return results
+
+
+def iter_chunks(items, size=CHUNK_SIZE):
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def result_key(node_type, peer, fail_fast=False, rules=None):
+    """
+    Key of everything validate() depends on for peer, for the result
+    cache, or None when a DNS lookup failed for a transient reason
+    """
+    rules = RULES if rules is None else rules
+    costs = {r.cost for r in rules}
+    inputs = [VERSION, node_type, strip_lines(peer), fail_fast, [r.name for r in rules]]
+
+    # with fail_fast, a failing cheap rule means the registry and DNS are never asked
+    if fail_fast and CPU in costs and not passes_cheap_rules(node_type, peer):
+        return result_cache.key(*inputs)
+
+    # validate_asn() is the only use of the registry
+    asn = validate_asn(peer["asn"]) if "asn" in peer and REGISTRY in costs else None
+
+    answers = {}
+    if DNS in costs and not (fail_fast and asn):
+        for hostname in endpoint_hostnames([peer]):
+            answers[hostname] = resolver.answer_key(hostname)
+            if answers[hostname] is None:
+                return None
+
+    return result_cache.key(*inputs, asn, answers)
+
+
+def validate_stream(items, jobs=1, fail_fast=False, rules=None):
+    """
+    Validate (key, node_type, peer) items as they arrive, yielding
+    (key, errors, output) for each peer in order. Wireguard endpoints
+    are resolved in the background a chunk ahead of validation; with
+    jobs > 1 chunks are spread across a process pool. Peers with a
+    result in the result cache are not validated again. With fail_fast
+    peers failing a cheap rule skip the registry and DNS rules; rules
+    limits validation to some of RULES.
+    """
+    rules = RULES if rules is None else rules
+    costs = {r.cost for r in rules}
+    waiting = deque()
+    running = deque()
+    pool = None
+
+    def hostnames(items):
+        if DNS not in costs:
+            return set()
+        # with fail_fast, peers failing a cheap rule are never resolved
+        return endpoint_hostnames(
+            peer for node_type, peer in items
+            if not (fail_fast and CPU in costs) or passes_cheap_rules(node_type, peer)
+        )
+
+    def dispatch(chunk):
+        result_keys = [result_key(node_type, peer, fail_fast, rules) for _, node_type, peer in chunk]
+        cached = [result_cache.get(result_key) if result_key else None for result_key in result_keys]
+
+        todo = [item[1:] for item, result in zip(chunk, cached) if result is None]
+        if not todo:
+            validated = []
+        elif pool:
+            validated = pool.submit(validate_chunk, todo, resolver.answers(hostnames(todo)), fail_fast, rules)
+        else:
+            validated = validate_chunk(todo, fail_fast=fail_fast, rules=rules)
+
+        return chunk, result_keys, cached, validated
+
+    def collect(chunk, result_keys, cached, validated):
+        if not isinstance(validated, list):
+            validated = validated.result()
+        validated = iter(validated)
+
+        for (key, _, _), result_key, result in zip(chunk, result_keys, cached):
+            if result is None:
+                result = next(validated)
+                if result_key:
+                    result_cache.put(result_key, *result)
+            errors, output = result
+            yield key, errors, output
+
+    try:
+        for chunk in iter_chunks(items):
+            resolver.submit(hostnames(item[1:] for item in chunk))
+            waiting.append(chunk)
+            if len(waiting) < 2:
+                continue
+
+            # the next chunk is resolving while this one is validated
+            chunk = waiting.popleft()
+            if jobs > 1 and pool is None:
+                # workers get the registry from here instead of each fetching it
+                asns = registry.asn_index() if REGISTRY in costs else None
+                pool = ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=init_worker, initargs=(asns,))
+            running.append(dispatch(chunk))
+
+            # bound the chunks held in memory
+            while len(running) > 2 * jobs:
+                yield from collect(*running.popleft())
+
+        while waiting:
+            running.append(dispatch(waiting.popleft()))
+        while running:
+            yield from collect(*running.popleft())
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+
 def post_annotation(error, file, line):
     if os.getenv("GITHUB_ACTIONS") == "true" and os.getenv("GITHUB_WORKFLOW"):
         github.error(error, title="Validation Error", file=file, line=line)
@@ -86,85 +463,188 @@ def read_yaml(filename):
             exit(1)
 
 
-def validate(node_type, peer):
-    errors = []
-
+def validate(node_type, peer, fail_fast=False, rules=None):
     print(f"Validating peer: {peer.get('name', '<missing>')}...", end="")
 
-    if "name" in peer:
-        errors.append(validate_name(peer["name"]))
-    else:
-        errors.append("name must exist")
+    # errors in the order the rules are declared, whatever order they ran in
+    results = run_rules(node_type, peer, RULES if rules is None else rules, fail_fast=fail_fast)
+    errors = [e for r in RULES for e in results.get(r.name, [])]
 
-    if "asn" in peer:
-        errors.append(validate_asn(peer["asn"]))
+    if len(errors):
+        print('\033[91m FAIL \033[0m')
     else:
-        errors.append("asn must exist")
+        print('\033[92m ok \033[0m')
+
+    return errors
+
+
+# Cost of a rule, cheapest first
+CPU, REGISTRY, DNS = range(3)
+
+Rule = namedtuple("Rule", "name fields cost check")
+RULES = []
+
+
+def rule(*fields, cost=CPU):
+    """Register a check of the given peer fields, see run_rules()"""
+    def register(check):
+        RULES.append(Rule(check.__name__, fields, cost, check))
+        return check
+    return register
+
+
+def rules_reading(fields):
+    """The rules reading any of fields, to rerun when those change"""
+    return [r for r in RULES if set(r.fields) & set(fields)]
+
 
+def run_rules(node_type, peer, rules=RULES, fail_fast=False):
+    """
+    Run rules against peer, cheapest first, returning the errors of
+    each by rule name. With fail_fast, rules costing more than one that
+    already failed are skipped. To recheck a peer after some fields
+    changed, update earlier results with those of rules_reading(fields).
+    """
+    peer = Peer.of(peer)
+    results = {}
+    failed = None
+
+    # sorted() is stable, rules of the same cost run in declaration order
+    for r in sorted(rules, key=lambda r: r.cost):
+        if fail_fast and failed is not None and r.cost > failed:
+            break
+
+        results[r.name] = [e for e in r.check(node_type, peer) if e]
+        if results[r.name] and failed is None:
+            failed = r.cost
+
+    return results
+
+
+def local_rules():
+    """Rules needing neither the registry nor DNS"""
+    return [r for r in RULES if r.cost == CPU]
+
+
+def network_rules():
+    return [r for r in RULES if r.cost != CPU]
+
+
+def passes_cheap_rules(node_type, peer):
+    return not any(run_rules(node_type, peer, local_rules()).values())
+
+
+@rule("name")
+def check_name(node_type, peer):
+    if "name" not in peer:
+        return ["name must exist"]
+    return [validate_name(peer["name"])]
+
+
+@rule("asn", cost=REGISTRY)
+def check_asn(node_type, peer):
+    if "asn" not in peer:
+        return ["asn must exist"]
+    return [validate_asn(peer["asn"])]
+
+
+@rule("ipv4", "ipv6")
+def check_ipv4(node_type, peer):
     if "ipv4" in peer:
-        errors.append(validate_ip(peer["ipv4"], af="ipv4", attrib="ipv4"))
-    elif "ipv6" not in peer:
-        errors.append("ipv4 or ipv6 must exist")
+        return [validate_ip(peer["ipv4"], af="ipv4", attrib="ipv4", interface=peer.ipv4)]
+    if "ipv6" not in peer:
+        return ["ipv4 or ipv6 must exist"]
+    return []
 
+
+@rule("local_ipv4")
+def check_local_ipv4(node_type, peer):
     if "local_ipv4" in peer:
-        errors.append(validate_ip(peer["local_ipv4"], af="ipv4", attrib="local_ipv4"))
+        return [validate_ip(peer["local_ipv4"], af="ipv4", attrib="local_ipv4", interface=peer.local_ipv4)]
+    return []
+
 
+@rule("ipv6")
+def check_ipv6(node_type, peer):
     if "ipv6" in peer:
-        errors.append(validate_ip(peer["ipv6"], af="ipv6", attrib="ipv6"))
+        return [validate_ip(peer["ipv6"], af="ipv6", attrib="ipv6", interface=peer.ipv6)]
+    return []
 
+
+@rule("local_ipv6")
+def check_local_ipv6(node_type, peer):
     if "local_ipv6" in peer:
-        errors.append(validate_ip(peer["local_ipv6"], af="ipv6", attrib="local_ipv6"))
+        return [validate_ip(peer["local_ipv6"], af="ipv6", attrib="local_ipv6", interface=peer.local_ipv6)]
+    return []
+
 
+@rule("multiprotocol")
+def check_multiprotocol(node_type, peer):
     if "multiprotocol" in peer:
-        errors.append(validate_boolean(peer["multiprotocol"]))
+        return [validate_boolean(peer["multiprotocol"])]
+    return []
+
+
+@rule("extended_nexthop", "ipv6", "sessions")
+def check_extended_nexthop(node_type, peer):
+    errors = []
 
     if "extended_nexthop" in peer:
+        sessions = peer.get("sessions", [])
         errors.append(validate_boolean(peer["extended_nexthop"]))
         if "ipv6" not in peer:
             errors.append("ipv6 required for extended_nexthop")
-        if "ipv6" not in peer["sessions"]:
+        if "ipv6" not in sessions:
             errors.append("sessions: [ipv6] required for extended_nexthop")
-        if "ipv4" in peer["sessions"]:
+        if "ipv4" in sessions:
             errors.append("sessions: [ipv4] must not exist with extended_nexthop")
 
-    if "sessions" in peer:
-        errors += validate_sessions(peer["sessions"], peer)
-    else:
-        errors.append("sessions must exist")
+    return errors
 
-    if "wireguard" in peer:
-        errors += validate_wireguard(peer["wireguard"], require_ipv4=(node_type=="ipv4"))
-    else:
-        errors.append("wireguard must exist")
 
-    if len(list(filter(None, errors))):
-        print('\033[91m FAIL \033[0m')
-    else:
-        print('\033[92m ok \033[0m')
+@rule("sessions", "ipv4", "ipv6", "multiprotocol")
+def check_sessions(node_type, peer):
+    if "sessions" not in peer:
+        return ["sessions must exist"]
+    return validate_sessions(peer["sessions"], peer)
 
-    return filter(None, errors)
 
+@rule("wireguard")
+def check_wireguard(node_type, peer):
+    if "wireguard" not in peer:
+        return ["wireguard must exist"]
+    if peer.wireguard is None:
+        return [validate_wireguard(peer["wireguard"])]
+    return validate_remote_port_required(peer.wireguard)
 
-def validate_unique_peers(this_peer, peers):
-    errors = []
 
-    for p in peers:
-        if this_peer["name"] == p["name"]: continue
+# remote_address is checked against the node type, which --offline does not
+# know, so even an IP address is only checked with the network checks
+@rule("wireguard", cost=DNS)
+def check_endpoint(node_type, peer):
+    if peer.wireguard is None:
+        return []
+    return validate_remote_address(peer.wireguard, require_ipv4=(node_type=="ipv4"))
+
 
-        for af in ['ipv4', 'ipv6']:
-            if af in this_peer and af in p:
-                if this_peer[af] == p[af]:
-                    errors.append(f"{af} address ({this_peer[af]}) must be unique per router: conflict with {p['name']}")
+@rule("wireguard")
+def check_wireguard_settings(node_type, peer):
+    if peer.wireguard is None:
+        return []
+    return validate_wireguard_settings(peer.wireguard)
 
-    return filter(None, errors)
+
+def validate_unique_peers(this_peer, peers):
+    position = next(i for i, peer in enumerate(peers) if peer is this_peer)
+    return RouterIndex(peers).conflicts(position)
 
 def validate_asn(number):
     # Build ASN cache
     global valid_asns
-    if not valid_asns:
-        valid_asns = Registry().asns()
+    if valid_asns is None:
+        valid_asns = registry.asn_index()
 
-    if f'AS{number}' not in valid_asns:
+    if number not in valid_asns:
         return f"asn: '{number}' must exist in the DN42 registry"
 
 def validate_boolean(attrib):
@@ -180,27 +660,32 @@ def validate_name(name):
         return f"name: '{name}' is not in a valid format, must match {required_format}"
 
 
-def validate_ip(addr, af, attrib):
-    try:
-        ip = ipaddress.ip_network(addr, strict=False)
-    except ValueError:
+DN42_IPV4 = ipaddress.ip_network("172.20.0.0/14")
+ULA_IPV6 = ipaddress.ip_network("fc00::/7")
+
+def validate_ip(addr, af, attrib, interface=None):
+    # addr as parsed by the Peer model, when given
+    if interface is None:
+        interface = parse_interface(addr)
+    if interface is None:
         return f"{attrib}: '{addr}' is not a valid IP address or prefix"
+    ip = interface.network
 
     if af == "ipv4":
         if ip.version != 4:
             return f"{attrib}: '{addr}' is not an IPv4 address"
-        if not ip.subnet_of(ipaddress.ip_network("172.20.0.0/14")):
+        if not ip.subnet_of(DN42_IPV4):
             return f"{attrib}: '{addr}' is not within 172.20.0.0/14"
-        if ip.num_addresses > 2 and  ip.broadcast_address == ipaddress.ip_interface(addr).ip:
+        if ip.num_addresses > 2 and  ip.broadcast_address == interface.ip:
             return f"{attrib}: '{addr}' cannot be the broadcast address"
 
     if af == "ipv6":
         if ip.version != 6:
             return f"{attrib}: '{addr}' is not an IPv6 address"
-        if not ip.is_link_local and not ip.subnet_of(ipaddress.ip_network("fc00::/7")):
+        if not ip.is_link_local and not ip.subnet_of(ULA_IPV6):
             return f"{attrib}: '{addr}' is not within fe80::/10 or fc00::/7"
 
-    if ip.num_addresses > 2 and ip.network_address == ipaddress.ip_interface(addr).ip:
+    if ip.num_addresses > 2 and ip.network_address == interface.ip:
         return f"{attrib}: '{addr}' cannot be the subnet address"
 
 def validate_sessions(sessions, peer):
@@ -223,51 +708,51 @@ def validate_sessions(sessions, peer):
     return errors
 
 
-def validate_wireguard(wg, require_ipv4=False):
-    errors = []
-
-    if not type(wg) is dict:
+def validate_wireguard(wg, require_ipv4=False, resolve=True):
+    if type(wg) is dict:
+        wg = WireguardEndpoint(wg)
+    elif not isinstance(wg, WireguardEndpoint):
         return f"wireguard: '{wg}' must be type dictionary"
 
-    if "remote_address" in wg.keys():
-        if "remote_port" not in wg.keys():
-            errors.append("wireguard.remote_port: must exist when remote_address defined")
+    return validate_remote_port_required(wg) + validate_remote_address(wg, require_ipv4, resolve) \
+        + validate_wireguard_settings(wg)
 
-        require_ipv4_error = "wireguard.remote_address must be an IPv4 address or have a valid DNS A record for an IPv4 only router"
-        try:
-            # test if value is already an IP address
-            remote_address = ipaddress.ip_address(wg["remote_address"])
 
-            #  if require_ipv4 address must be IPv4 address
-            if require_ipv4 and not isinstance(remote_address, ipaddress.IPv4Address):
-                errors.append(require_ipv4_error)
+def validate_remote_port_required(wg):
+    if "remote_address" in wg.keys() and "remote_port" not in wg.keys():
+        return ["wireguard.remote_port: must exist when remote_address defined"]
+    return []
 
-            # ensure the address is not a private address
-            if remote_address.is_private:
-                errors.append("wireguard.remote_address must be public")
-        except ValueError:
-            try:
-                # skip resolving AAAA record if we require an IPv4
-                if require_ipv4:
-                    raise dns.exception.DNSException
-
-                # if not an IP address; attempt to resolve AAAA record
-                for rdata in dns.resolver.resolve(wg["remote_address"], "AAAA"):
-                    # ensure resolved entries are not private addresses
-                    if ipaddress.ip_address(rdata.address).is_private:
-                        errors.append("wireguard.remote_address must be public")
-            except dns.exception.DNSException:
-                try:
-                    # if no AAAA record; attempt to resolve A record
-                    for rdata in dns.resolver.resolve(wg["remote_address"], "A"):
-                        # ensure resolved entries are not private addresses
-                        if ipaddress.ip_address(rdata.address).is_private:
-                            errors.append("wireguard.remote_address must be public")
-                except dns.exception.DNSException:
-                    errors.append(
-                        require_ipv4_error if require_ipv4
-                        else "wireguard.remote_address is not a valid IPv4/IPv6 address or no DNS A/AAAA record found"
-                    )
+
+def validate_remote_address(wg, require_ipv4=False, resolve=True):
+    errors = []
+    if "remote_address" not in wg.keys():
+        return errors
+
+    require_ipv4_error = "wireguard.remote_address must be an IPv4 address or have a valid DNS A record for an IPv4 only router"
+    # remote_address is parsed once, by WireguardEndpoint
+    if wg.ip is not None:
+        #  if require_ipv4 address must be IPv4 address
+        if require_ipv4 and not isinstance(wg.ip, ipaddress.IPv4Address):
+            errors.append(require_ipv4_error)
+
+        # ensure the address is not a private address
+        if wg.ip.is_private:
+            errors.append("wireguard.remote_address must be public")
+    elif wg.hostname is None:
+        # neither an address nor a hostname to resolve
+        errors.append(
+            require_ipv4_error if require_ipv4
+            else "wireguard.remote_address is not a valid IPv4/IPv6 address or no DNS A/AAAA record found"
+        )
+    elif resolve:
+        errors += validate_endpoint(wg.hostname, require_ipv4)
+
+    return errors
+
+
+def validate_wireguard_settings(wg):
+    errors = []
 
     if "remote_port" in wg.keys():
         if "remote_address" not in wg.keys():
@@ -286,8 +771,79 @@ def validate_wireguard(wg, require_ipv4=False):
     return errors
 
 
+def validate_endpoint(hostname, require_ipv4=False):
+    errors = []
+    require_ipv4_error = "wireguard.remote_address must be an IPv4 address or have a valid DNS A record for an IPv4 only router"
+
+    # skip resolving AAAA record if we require an IPv4, otherwise look up
+    # both at once and use the AAAA record when there is one
+    rdtypes = ["A"] if require_ipv4 else ["AAAA", "A"]
+    resolver.submit([hostname], rdtypes)
+
+    failures = []
+    for rdtype in rdtypes:
+        try:
+            addresses = resolver.resolve(hostname, rdtype)
+        except dns.exception.DNSException as e:
+            failures.append(e)
+            continue
+
+        # ensure resolved entries are not private addresses
+        for address in addresses:
+            if ipaddress.ip_address(address).is_private:
+                errors.append("wireguard.remote_address must be public")
+        return errors
+
+    if any(is_timeout(e) for e in failures):
+        errors.append(DNS_TIMEOUT_ERROR)
+    else:
+        errors.append(
+            require_ipv4_error if require_ipv4
+            else "wireguard.remote_address is not a valid IPv4/IPv6 address or no DNS A/AAAA record found"
+        )
+
+    return errors
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Validate dn42-peers')
     parser.add_argument('--router', help='Run validation against specific router')
+    parser.add_argument('-v', '--verbose', action='store_true',
+            help='Log progress, including when each startup step finished')
+    parser.add_argument('--jobs', type=int, default=1,
+            help='Number of processes to validate peers with')
+    tiers = parser.add_mutually_exclusive_group()
+    tiers.add_argument('--offline', action='store_true',
+            help='Only run the checks needing neither the registry nor DNS, queueing the rest for --network-only')
+    tiers.add_argument('--network-only', action='store_true',
+            help='Run the registry and DNS checks queued by --offline')
+    parser.add_argument('--queue', metavar='FILE', default='.cache/network-queue.json',
+            help='File --offline queues network checks in for --network-only')
+    parser.add_argument('--fail-fast', action='store_true',
+            help='Skip registry and DNS checks of peers that already failed a cheaper check')
+    parser.add_argument('--changed-since', metavar='REF',
+            help='Only validate peers added or modified since a git ref')
+    parser.add_argument('--shard', metavar='i/N', type=parse_shard,
+            help='Only validate the i-th of N shards of the routers, balanced by peers and DNS endpoints')
+    parser.add_argument('--errors', metavar='FILE',
+            help='Also write the errors to a file, to merge shards with shards.py')
+    parser.add_argument('--dns-cache', default='.cache/dns.json',
+            help='File to keep DNS answers in between runs')
+    parser.add_argument('--dns-max-age', type=int, default=Resolver.MAX_AGE,
+            help='Maximum seconds to reuse a cached DNS answer, regardless of TTL')
+    parser.add_argument('--dns-timeout', type=float, default=Resolver.TIMEOUT,
+            help='Seconds to wait for one DNS lookup')
+    parser.add_argument('--dns-budget', type=float, default=Resolver.BUDGET,
+            help='Seconds all DNS lookups may take together; lookups left after it time out')
+    parser.add_argument('--refresh-dns', action='store_true',
+            help='Ignore cached DNS answers and resolve everything again')
+    parser.add_argument('--result-cache', default='.cache/results.json',
+            help='File to keep validation results of unchanged peers in between runs')
+    parser.add_argument('--refresh-results', action='store_true',
+            help='Ignore cached validation results and validate every peer again')
+    parser.add_argument('--registry-max-age', type=int, default=Registry.MAX_AGE,
+            help='Maximum seconds to use the registry snapshot before refreshing it')
+    parser.add_argument('--nodes-max-age', type=int, default=NodeCatalog.MAX_AGE,
+            help='Maximum seconds to use the node catalog snapshot before refreshing it')
     args = parser.parse_args()
     main(args)